@@ -18,34 +18,57 @@
 """
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
 import sqlite3
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import atexit
+import calendar
 import contextlib
+import functools
 import os
-import time
+import queue
+import re
+import threading
 from datetime import datetime, timedelta, date
-from typing import Optional, Tuple, Dict, List
+from typing import Callable, Optional, Tuple, Dict, List
+
+try:
+    from dateutil.relativedelta import relativedelta
+except ImportError:
+    relativedelta = None
 
 # ============================================================================
-# 日誌配置 (改進版 - 使用 RotatingFileHandler)
+# 日誌配置 (改進版 - RotatingFileHandler 經 QueueListener 背景寫檔)
 # ============================================================================
 LOG_DIR = os.path.join(os.getcwd(), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
 
-handler = RotatingFileHandler(
-    os.path.join(LOG_DIR, "rental_system.log"),
-    maxBytes=10*1024*1024,
-    backupCount=5,
-    encoding='utf-8'
-)
 
-logging.basicConfig(
-    handlers=[handler],
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
+def _init_logging():
+    # Streamlit 每次 rerun 都會重新執行本檔，已掛上 QueueHandler 時直接返回，不再碰檔案系統
+    root_logger = logging.getLogger()
+    if any(isinstance(h, QueueHandler) for h in root_logger.handlers):
+        return
+    
+    os.makedirs(LOG_DIR, exist_ok=True)
+    handler = RotatingFileHandler(
+        os.path.join(LOG_DIR, "rental_system.log"),
+        maxBytes=10*1024*1024,
+        backupCount=5,
+        encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+    
+    log_queue = queue.Queue(-1)
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+
 
 logger = logging.getLogger(__name__)
 
@@ -55,9 +78,21 @@ logger = logging.getLogger(__name__)
 ALL_ROOMS = ["1A", "1B", "2A", "2B", "3A", "3B", "3C", "3D", "4A", "4B", "4C", "4D"]
 SHARING_ROOMS = ["2A", "2B", "3A", "3B", "3C", "3D", "4A", "4B", "4C", "4D"]
 NON_SHARING_ROOMS = ["1A", "1B"]
+# 房號成員判斷用 (清單保留給需要固定順序的迴圈)
+ALL_ROOMS_SET = frozenset(ALL_ROOMS)
 EXPENSE_CATEGORIES = ["維修", "雜項", "貸款", "水電費", "網路費"]
 PAYMENT_METHODS = ["月繳", "半年繳", "年繳"]
 WATER_FEE = 100
+RENT_RECORDS_PAGE_SIZE = 50
+SCHEMA_VERSION = 8
+# 電費表單 session_state 欄位鍵：(樓層, 金額鍵, 度數鍵) 與 (房號, 開始度數鍵, 結束度數鍵)
+TDY_INPUT_KEYS = tuple((floor, f"fee{floor.lower()}", f"kwh{floor.lower()}") for floor in ("2F", "3F", "4F"))
+METER_INPUT_KEYS = tuple((room, f"start_{room}", f"end_{room}") for room in ALL_ROOMS)
+TENANT_COLUMNS = ("id", "room_number", "tenant_name", "phone", "deposit", "base_rent", "lease_start", "lease_end",
+                  "payment_method", "has_discount", "has_water_fee", "discount_notes", "last_ac_cleaning_date",
+                  "annual_discount_months", "annual_discount_amount", "is_active", "created_at")
+# Excel 匯入只讀這幾欄，其餘欄位不解析
+IMPORT_COLUMNS = frozenset(("房號", "房客", "租金"))
 
 # ============================================================================
 # 電費計算類 (修復版)
@@ -75,7 +110,7 @@ class ElectricityCalculatorV10:
 
     def check_tdy_bills(self, tdy_data: Dict[str, Tuple[float, float]]) -> bool:
         st.markdown("### 📊 【第 1 步】台電單據檢查")
-        valid_count = 0
+        rows = []
         total_kwh = 0
         total_fee = 0
         
@@ -87,78 +122,78 @@ class ElectricityCalculatorV10:
             elif fee == 0:
                 self.errors.append(f"🚨 {floor}: 費用為 0（無法計算單價）")
             elif kwh > 0 and fee > 0:
-                unit_price = fee / kwh
-                st.success(f"✅ {floor}: {kwh:.1f}度 × ${unit_price:.4f}/度 = ${fee:,.0f}")
-                valid_count += 1
+                rows.append({"樓層": floor, "度數": f"{kwh:.1f}", "單價": f"${fee / kwh:.4f}/度", "金額": f"${fee:,.0f}", "狀態": "✅"})
                 total_kwh += kwh
                 total_fee += fee
         
-        if valid_count == 0:
+        if not rows:
             self.errors.append("🚨 沒有任何有效的台電單據")
             return False
         
+        # 各樓層結果合成一張表、總結合成一則訊息，不逐筆送出
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        
         self.unit_price = total_fee / total_kwh
         self.tdy_total_kwh = total_kwh
         self.tdy_total_fee = total_fee
         
-        st.success(f"✅ 台電驗證通過")
-        st.info(f" 台電總度數: {total_kwh:.2f}度")
-        st.info(f" 台電總金額: ${total_fee:,.0f}")
-        st.success(f"📊 【當期電度單價】${self.unit_price:.4f}/度")
+        st.success(f"✅ 台電驗證通過  \n"
+                   f"台電總度數: {total_kwh:.2f}度  \n"
+                   f"台電總金額: ${total_fee:,.0f}  \n"
+                   f"📊 【當期電度單價】${self.unit_price:.4f}/度")
         return True
 
     def check_meter_readings(self, meter_data: Dict[str, Tuple[float, float]]) -> bool:
         st.markdown("### 📟 【第 2 步】房間度數檢查")
-        valid_count = 0
-        total_kwh = 0
         
-        for room in NON_SHARING_ROOMS:
-            start, end = meter_data[room]
-            if end > start:
-                usage = round(end - start, 2)
-                self.non_sharing_records[room] = usage
-                st.info(f"📝 {room}: {start:.2f} → {end:.2f} (記錄: {usage:.2f}度，不計算)")
+        # 度數相減/四捨五入/有效判斷整批以 numpy 陣列計算，結果併成一張表輸出
+        readings = np.array([meter_data[room] for room in NON_SHARING_ROOMS], dtype=float)
+        starts, ends = readings[:, 0], readings[:, 1]
+        usage = np.round(ends - starts, 2)
+        recorded = ends > starts
+        for i in np.flatnonzero(recorded):
+            self.non_sharing_records[NON_SHARING_ROOMS[i]] = float(usage[i])
+        table = [pd.DataFrame({"房號": NON_SHARING_ROOMS, "上期": starts, "本期": ends, "度數": usage, "狀態": "📝 記錄，不計算"})[recorded]]
         
-        st.divider()
+        readings = np.array([meter_data[room] for room in SHARING_ROOMS], dtype=float)
+        starts, ends = readings[:, 0], readings[:, 1]
+        usage = np.round(ends - starts, 2)
+        valid = ends > starts
         
-        for room in SHARING_ROOMS:
-            start, end = meter_data[room]
-            if start == 0 and end == 0:
-                continue
-            elif end <= start and not (start == 0 and end == 0):
-                if end < start:
-                    self.errors.append(f"🚨 {room}: 本期 < 上期")
-            else:
-                usage = round(end - start, 2)
-                st.success(f"✅ {room}: {start:.2f} → {end:.2f} (度數: {usage:.2f})")
-                valid_count += 1
-                total_kwh += usage
+        for i in np.flatnonzero(ends < starts):
+            self.errors.append(f"🚨 {SHARING_ROOMS[i]}: 本期 < 上期")
+        table.append(pd.DataFrame({"房號": SHARING_ROOMS, "上期": starts, "本期": ends, "度數": usage, "狀態": "✅"})[valid])
+        
+        table = pd.concat(table, ignore_index=True)
+        if not table.empty:
+            st.dataframe(table, use_container_width=True, hide_index=True)
         
+        valid_count = int(valid.sum())
         if valid_count == 0:
             self.errors.append("🚨 沒有分攤房間的度數")
             return False
         
-        self.meter_total_kwh = round(total_kwh, 2)
-        st.success(f"✅ 房間度數驗證通過: {valid_count} 間房間")
-        st.info(f" 分攤房間私表總度數: {self.meter_total_kwh:.2f}度")
+        self.meter_total_kwh = round(float(usage[valid].sum()), 2)
+        st.success(f"✅ 房間度數驗證通過: {valid_count} 間房間  \n"
+                   f"分攤房間私表總度數: {self.meter_total_kwh:.2f}度")
         return True
 
     def calculate_public_electricity(self) -> bool:
         st.markdown("### ⚖️ 【第 2-3 步】公用電計算")
         self.public_kwh = round(self.tdy_total_kwh - self.meter_total_kwh, 2)
         
-        st.info(f"公用電度數 = 台電總度數 - 分攤房間私表總度數")
-        st.info(f" = {self.tdy_total_kwh:.2f} - {self.meter_total_kwh:.2f}")
-        st.success(f" = {self.public_kwh:.2f}度")
+        st.info(f"公用電度數 = 台電總度數 - 分攤房間私表總度數  \n"
+                f" = {self.tdy_total_kwh:.2f} - {self.meter_total_kwh:.2f}  \n"
+                f" = **{self.public_kwh:.2f}度**")
         
         if self.public_kwh < 0:
             self.errors.append(f"🚨 公用電度數為負數")
             return False
         
         self.public_per_room = round(self.public_kwh / len(SHARING_ROOMS))
-        st.info(f"每戶分攤度數 = 公用電度數 ÷ {len(SHARING_ROOMS)}間")
-        st.info(f" = {self.public_kwh:.2f} ÷ {len(SHARING_ROOMS)}")
-        st.success(f" = {self.public_per_room}度/戶（四捨五入）")
+        st.info(f"每戶分攤度數 = 公用電度數 ÷ {len(SHARING_ROOMS)}間  \n"
+                f" = {self.public_kwh:.2f} ÷ {len(SHARING_ROOMS)}  \n"
+                f" = **{self.public_per_room}度/戶**（四捨五入）")
         return True
 
     def diagnose(self) -> Tuple[bool, str]:
@@ -174,14 +209,21 @@ class ElectricityCalculatorV10:
 # ============================================================================
 # 繳費計畫生成工具
 # ============================================================================
-def generate_payment_schedule(payment_method: str, start_date: str, end_date: str) -> List[Tuple[int, int]]:
-    try:
-        from dateutil.relativedelta import relativedelta
-        use_relativedelta = True
-    except ImportError:
-        use_relativedelta = False
+def to_epoch(d: date) -> int:
+    # 與 SQLite strftime('%s', 'YYYY-MM-DD') 一致：該日 00:00 UTC 的秒數
+    return calendar.timegm(d.timetuple())
+
+
+def generate_payment_schedule(payment_method: str, start_date: str, end_date: str) -> Tuple[Tuple[int, int], ...]:
+    if relativedelta is None:
         logger.warning("dateutil 未安裝，使用簡化版本計算月份")
-    
+    return _payment_schedule(payment_method, start_date, end_date)
+
+
+# 純函式且輸入組合少 (批次匯入時多數房客同繳法同租期)，回傳 tuple 以便安全共用快取結果
+@functools.lru_cache(maxsize=256)
+def _payment_schedule(payment_method: str, start_date: str, end_date: str) -> Tuple[Tuple[int, int], ...]:
+    use_relativedelta = relativedelta is not None
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
     schedule = []
@@ -194,7 +236,6 @@ def generate_payment_schedule(payment_method: str, start_date: str, end_date: st
         if payment_method == "月繳":
             schedule.append((year, month))
             if use_relativedelta:
-                from dateutil.relativedelta import relativedelta
                 current = current + relativedelta(months=1)
             else:
                 if month == 12:
@@ -205,7 +246,6 @@ def generate_payment_schedule(payment_method: str, start_date: str, end_date: st
             if month in [1, 7]:
                 schedule.append((year, month))
             if use_relativedelta:
-                from dateutil.relativedelta import relativedelta
                 current = current + relativedelta(months=6)
             else:
                 if month == 7:
@@ -216,291 +256,571 @@ def generate_payment_schedule(payment_method: str, start_date: str, end_date: st
             if month == 1:
                 schedule.append((year, month))
             if use_relativedelta:
-                from dateutil.relativedelta import relativedelta
                 current = current + relativedelta(years=1)
             else:
                 current = datetime(year + 1, 1, 1)
     
-    return schedule
+    return tuple(schedule)
 
 
 # ============================================================================
 # 數據庫類
 # ============================================================================
+# 舊版資料庫缺欄位時的補欄語句 (表, 欄位, DDL)
+_SCHEMA_FIXES = [
+    ("tenants", "payment_method", "ALTER TABLE tenants ADD COLUMN payment_method TEXT DEFAULT '月繳'"),
+    ("tenants", "discount_notes", "ALTER TABLE tenants ADD COLUMN discount_notes TEXT DEFAULT ''"),
+    ("tenants", "last_ac_cleaning_date", "ALTER TABLE tenants ADD COLUMN last_ac_cleaning_date TEXT"),
+    ("tenants", "has_discount", "ALTER TABLE tenants ADD COLUMN has_discount INTEGER DEFAULT 0"),
+    ("tenants", "has_water_fee", "ALTER TABLE tenants ADD COLUMN has_water_fee INTEGER DEFAULT 0"),
+    ("rent_records", "status", "ALTER TABLE rent_records ADD COLUMN status TEXT DEFAULT '待確認'"),
+    ("electricity_period", "notes", "ALTER TABLE electricity_period ADD COLUMN notes TEXT DEFAULT ''"),
+    ("payment_schedule", "due_epoch", "ALTER TABLE payment_schedule ADD COLUMN due_epoch INTEGER"),
+    ("payment_schedule", "paid_epoch", "ALTER TABLE payment_schedule ADD COLUMN paid_epoch INTEGER"),
+]
+
+# 建表與索引各以一段腳本在單一交易內執行；索引在欄位修復之後才建，舊庫補上的 due_epoch 才能入索引
+_TABLE_DDL = """
+BEGIN;
+CREATE TABLE IF NOT EXISTS tenants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_number TEXT UNIQUE NOT NULL,
+    tenant_name TEXT NOT NULL,
+    phone TEXT,
+    deposit REAL DEFAULT 0,
+    base_rent REAL DEFAULT 0,
+    lease_start TEXT NOT NULL,
+    lease_end TEXT NOT NULL,
+    payment_method TEXT DEFAULT '月繳',
+    has_discount INTEGER DEFAULT 0,
+    has_water_fee INTEGER DEFAULT 0,
+    discount_notes TEXT,
+    last_ac_cleaning_date TEXT,
+    annual_discount_months INTEGER DEFAULT 0,
+    annual_discount_amount REAL DEFAULT 0,
+    is_active INTEGER DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payment_schedule (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_number TEXT NOT NULL,
+    tenant_name TEXT NOT NULL,
+    payment_year INTEGER NOT NULL,
+    payment_month INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    payment_method TEXT DEFAULT '月繳',
+    due_date TEXT,
+    paid_date TEXT,
+    due_epoch INTEGER,
+    paid_epoch INTEGER,
+    paid_amount REAL DEFAULT 0,
+    status TEXT DEFAULT '未繳',
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(room_number) REFERENCES tenants(room_number),
+    UNIQUE(room_number, payment_year, payment_month)
+);
+
+CREATE TABLE IF NOT EXISTS rent_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_number TEXT NOT NULL,
+    tenant_name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    base_amount REAL NOT NULL,
+    water_fee REAL DEFAULT 0,
+    discount_amount REAL DEFAULT 0,
+    actual_amount REAL NOT NULL,
+    paid_amount REAL DEFAULT 0,
+    paid_date TEXT,
+    payment_method TEXT,
+    notes TEXT,
+    status TEXT DEFAULT '待確認',
+    recorded_by TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(room_number) REFERENCES tenants(room_number),
+    UNIQUE(room_number, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS rent_payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_number TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    paid_date TEXT,
+    is_paid INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(room_number) REFERENCES tenants(room_number),
+    UNIQUE(room_number, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS electricity_period (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    period_year INTEGER NOT NULL,
+    period_month_start INTEGER NOT NULL,
+    period_month_end INTEGER NOT NULL,
+    tdy_total_kwh REAL DEFAULT 0,
+    tdy_total_fee REAL DEFAULT 0,
+    unit_price REAL DEFAULT 0,
+    public_kwh REAL DEFAULT 0,
+    public_per_room INTEGER DEFAULT 0,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS electricity_tdy_bill (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    period_id INTEGER NOT NULL,
+    floor_name TEXT NOT NULL,
+    tdy_total_kwh REAL NOT NULL,
+    tdy_total_fee REAL NOT NULL,
+    FOREIGN KEY(period_id) REFERENCES electricity_period(id),
+    UNIQUE(period_id, floor_name)
+);
+
+CREATE TABLE IF NOT EXISTS electricity_meter (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    period_id INTEGER NOT NULL,
+    room_number TEXT NOT NULL,
+    meter_start_reading REAL NOT NULL,
+    meter_end_reading REAL NOT NULL,
+    meter_kwh_usage REAL NOT NULL,
+    FOREIGN KEY(period_id) REFERENCES electricity_period(id),
+    UNIQUE(period_id, room_number)
+);
+
+CREATE TABLE IF NOT EXISTS electricity_calculation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    period_id INTEGER NOT NULL,
+    room_number TEXT NOT NULL,
+    private_kwh REAL NOT NULL,
+    public_kwh INTEGER NOT NULL,
+    total_kwh REAL NOT NULL,
+    unit_price REAL NOT NULL,
+    calculated_fee REAL NOT NULL,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(period_id) REFERENCES electricity_period(id),
+    UNIQUE(period_id, room_number)
+);
+
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    expense_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS memos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    memo_text TEXT NOT NULL,
+    priority TEXT DEFAULT 'normal',
+    is_completed INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+COMMIT;
+"""
+
+_INDEX_DDL = """
+BEGIN;
+DROP INDEX IF EXISTS idx_tenants_active;
+DROP INDEX IF EXISTS idx_ps_status_due;
+DROP INDEX IF EXISTS idx_ps_status_due_epoch;
+DROP INDEX IF EXISTS idx_rp_paid_room;
+DROP INDEX IF EXISTS idx_rp_year_room_month;
+CREATE INDEX IF NOT EXISTS idx_tenants_active_room ON tenants(room_number) WHERE is_active=1;
+CREATE INDEX IF NOT EXISTS idx_payment_schedule_room ON payment_schedule(room_number);
+CREATE INDEX IF NOT EXISTS idx_payment_schedule_status ON payment_schedule(status);
+-- 逾期/即將到期查詢所需欄位全在索引內，不必回表
+CREATE INDEX IF NOT EXISTS idx_ps_overdue_cover
+    ON payment_schedule(status, due_epoch, room_number, tenant_name, payment_month, amount, due_date);
+CREATE INDEX IF NOT EXISTS idx_rr_year_month_status ON rent_records(year, month, status);
+-- 依狀態篩選的租金清單與按年份取出的租金矩陣，都能直接沿索引順序讀出
+CREATE INDEX IF NOT EXISTS idx_rr_status_ym ON rent_records(status, year, month, room_number);
+CREATE INDEX IF NOT EXISTS idx_rr_year_room_month ON rent_records(year, room_number, month);
+-- 新增期間前的重複檢查走索引，不必掃整張期間表
+CREATE INDEX IF NOT EXISTS idx_period_ym ON electricity_period(period_year, period_month_start, period_month_end);
+COMMIT;
+"""
+
+# 熱點查詢固定為同一字串，讓 sqlite3 的語句快取直接重用已編譯的語句
+_Q_TENANTS = f"SELECT {', '.join(TENANT_COLUMNS)} FROM tenants WHERE is_active=1 ORDER BY room_number"
+_Q_ROOM_EXISTS = "SELECT 1 FROM tenants WHERE room_number=? AND is_active=1"
+_Q_ACTIVE_ROOMS = "SELECT room_number FROM tenants WHERE is_active=1"
+_Q_PAYMENT_SUMMARY = """SELECT COALESCE(SUM(amount), 0),
+                               COALESCE(SUM(CASE WHEN status='已繳' THEN paid_amount END), 0),
+                               COALESCE(SUM(CASE WHEN status='未繳' THEN 1 END), 0)
+                        FROM payment_schedule WHERE payment_year=?"""
+_Q_RENT_SUMMARY = """SELECT COALESCE(SUM(actual_amount), 0),
+                            COALESCE(SUM(CASE WHEN status='已收' THEN paid_amount END), 0),
+                            COALESCE(SUM(CASE WHEN status IN ('未收', '待確認') THEN actual_amount END), 0)
+                     FROM rent_records WHERE year=?"""
+
+# 熱點寫入語句同樣集中成常數，寫入連線的語句快取可直接重用；updated_at 由 SQLite 以本地時間填入，與既有資料格式一致
+_Q_MARK_PAYMENT_DONE = """UPDATE payment_schedule SET status='已繳', paid_date=?, paid_epoch=?, paid_amount=?, notes=?, updated_at=datetime('now', 'localtime') WHERE id=?"""
+_Q_UPSERT_RENT_RECORD = """INSERT INTO rent_records (room_number, tenant_name, year, month, base_amount, water_fee, discount_amount, actual_amount, paid_amount, payment_method, notes, status, recorded_by, updated_at)
+                           VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+                           ON CONFLICT(room_number, year, month) DO UPDATE SET
+                               tenant_name=excluded.tenant_name, base_amount=excluded.base_amount, water_fee=excluded.water_fee,
+                               discount_amount=excluded.discount_amount, actual_amount=excluded.actual_amount, paid_amount=excluded.paid_amount,
+                               paid_date=NULL, payment_method=excluded.payment_method, notes=excluded.notes, status=excluded.status,
+                               recorded_by=excluded.recorded_by, updated_at=excluded.updated_at"""
+_Q_CONFIRM_RENT = "UPDATE rent_records SET status='已收', paid_date=?, paid_amount=?, updated_at=datetime('now', 'localtime') WHERE id=?"
+_Q_UPSERT_TDY_BILL = """INSERT INTO electricity_tdy_bill(period_id, floor_name, tdy_total_kwh, tdy_total_fee) VALUES(?, ?, ?, ?)
+                        ON CONFLICT(period_id, floor_name) DO UPDATE SET tdy_total_kwh=excluded.tdy_total_kwh, tdy_total_fee=excluded.tdy_total_fee"""
+_Q_UPSERT_METER = """INSERT INTO electricity_meter(period_id, room_number, meter_start_reading, meter_end_reading, meter_kwh_usage) VALUES(?, ?, ?, ?, ?)
+                     ON CONFLICT(period_id, room_number) DO UPDATE SET meter_start_reading=excluded.meter_start_reading,
+                         meter_end_reading=excluded.meter_end_reading, meter_kwh_usage=excluded.meter_kwh_usage"""
+_Q_INSERT_EXPENSE = "INSERT INTO expenses(expense_date, category, amount, description) VALUES(?, ?, ?, ?)"
+
+# 每條連線開啟時套用的調校；journal_mode=WAL 寫在檔案內，由 _ensure_schema 設一次即可
+_CONN_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+# 讀取連線池上限與池滿時等待歸還的秒數
+_POOL_SIZE = min(4, os.cpu_count() or 1)
+_POOL_TIMEOUT = 30
+
 class RentalDB:
-    def __init__(self, db_path: str = "rental_system_12rooms.db"):
+    def __init__(self, db_path: str = "rental_system_12rooms.db", on_change: Optional[Callable[[], None]] = None):
         self.db_path = db_path
-        self._init_db()
-        self._force_fix_schema()
-        self._create_indexes()
+        # 寫入版本號：每次有資料異動就遞增，讀取快取以此判斷是否失效
+        self._ver = 0
+        self._memo = {}
+        # 資料異動時的通知；頁面層的快取清除由 get_db 掛上，資料層本身不碰 Streamlit
+        self._on_change = on_change
+        # 專用寫入連線：所有寫入以 BEGIN IMMEDIATE 先取得寫鎖，不在交易中途升級而撞 SQLITE_BUSY
+        self._write_conn = None
+        self._write_lock = threading.Lock()
+        # 讀取連線池：WAL 下多個讀者可與寫入者並行，連線用到才開，最多 _POOL_SIZE 條
+        self._pool = queue.LifoQueue()
+        self._pool_opened = 0
+        self._pool_lock = threading.Lock()
+        atexit.register(self._close_connections)
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        # user_version 已是最新時跳過建表/修復/索引，避免每次建構都重跑 DDL
+        with self._get_connection() as conn:
+            # WAL 寫在資料庫檔內、持續有效，每個實例設一次即可，不必每次開連線都切換
+            conn.execute("PRAGMA journal_mode = WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            self._init_db(conn)
+            fixed = self._force_fix_schema(conn)
+            # v8 起租金矩陣與未收清單只讀 rent_records，舊版 rent_payments 的資料要先搬過來
+            migrated = version >= 8 or self._migrate_rent_payments(conn)
+            indexed = self._create_indexes(conn)
+            if fixed and migrated and indexed:
+                # 建完索引立即蒐集統計，查詢規劃器一開始就有 sqlite_stat1 可用
+                conn.execute("ANALYZE")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                logger.info(f"數據庫 Schema 版本: {SCHEMA_VERSION}")
+
+    def _migrate_rent_payments(self, conn) -> bool:
+        try:
+            # 已有 rent_records 的月份以 rent_records 為準 (INSERT OR IGNORE)，重跑也不會重複
+            c = conn.execute("""INSERT OR IGNORE INTO rent_records(room_number, tenant_name, year, month, base_amount, actual_amount,
+                                                                   paid_amount, paid_date, status, recorded_by)
+                                SELECT p.room_number, t.tenant_name, p.year, p.month, p.amount, p.amount,
+                                       CASE WHEN p.is_paid = 1 THEN p.amount ELSE 0 END, p.paid_date,
+                                       CASE WHEN p.is_paid = 1 THEN '已收' ELSE '未收' END, 'rent_payments'
+                                FROM rent_payments p JOIN tenants t ON t.room_number = p.room_number""")
+            conn.commit()
+            logger.info(f"舊版租金資料轉入 rent_records: {c.rowcount} 筆")
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"舊版租金資料轉移失敗: {e}")
+            return False
 
-    def _create_indexes(self):
+    def _create_indexes(self, conn) -> bool:
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_tenants_active ON tenants(is_active)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_schedule_room ON payment_schedule(room_number)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_schedule_status ON payment_schedule(status)")
-                logger.info("數據庫索引創建完成")
+            conn.executescript(_INDEX_DDL)
+            logger.info("數據庫索引創建完成")
+            return True
         except Exception as e:
             logger.error(f"索引創建失敗: {e}")
+            return False
 
     def reset_database(self):
         try:
             if os.path.exists(self.db_path):
-                os.remove(self.db_path)
+                if not self._close_connections():
+                    return False, "⚠️ 仍有讀取中的連線，請稍後再試"
+                # WAL/SHM 檔一併刪除，新資料庫才不會讀到舊的 WAL 內容
+                for path in (self.db_path, f"{self.db_path}-wal", f"{self.db_path}-shm"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._bump_version()
+                # 實例由 get_db 跨 rerun 共用，刪檔後要自行重建 schema
+                self._ensure_schema()
                 return True, "✅ 資料庫已重置"
             return False, "⚠️ 資料庫不存在"
         except Exception as e:
             logger.error(f"重置失敗: {e}")
             return False, str(e)
 
+    def analyze(self):
+        # 連線長駐很少關閉，PRAGMA optimize 難得執行；由主程式每天呼叫一次重新蒐集完整統計
+        with self._get_write_connection() as conn:
+            conn.execute("ANALYZE")
+
+    def checkpoint(self):
+        # 把 WAL 內容併回主檔，直接讀檔備份時才會拿到完整資料
+        with self._get_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _connect(self, **kwargs):
+        # 連線長駐，語句快取放大到 256，查詢字串固定 (參數一律用 ? 綁定) 就能重用編譯好的語句
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, cached_statements=256, **kwargs)
+        for pragma in _CONN_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire_conn(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._pool_opened < _POOL_SIZE:
+                self._pool_opened += 1
+                return self._connect()
+        # 池已滿，等其他呼叫端歸還；逾時代表連線被巢狀借用或未歸還，直接報錯而不是讓頁面卡住
+        try:
+            return self._pool.get(timeout=_POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError(f"讀取連線池逾時：{_POOL_SIZE} 條連線於 {_POOL_TIMEOUT} 秒內皆未歸還")
+
     @contextlib.contextmanager
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        # 讀取 (與建表/checkpoint) 用：長駐連線從池中借用，只在開啟時套用 PRAGMA；資料異動一律走 _get_write_connection
+        conn = self._acquire_conn()
         try:
-            conn.execute("PRAGMA foreign_keys = ON")
-            conn.execute("PRAGMA journal_mode = WAL")
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"數據庫操作失敗: {e}")
-            raise
+            changes = conn.total_changes
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"數據庫操作失敗: {e}")
+                raise
+            if conn.total_changes != changes:
+                self._bump_version()
         finally:
-            conn.close()
+            self._pool.put(conn)
 
-    def _init_db(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""CREATE TABLE IF NOT EXISTS tenants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_number TEXT UNIQUE NOT NULL,
-                tenant_name TEXT NOT NULL,
-                phone TEXT,
-                deposit REAL DEFAULT 0,
-                base_rent REAL DEFAULT 0,
-                lease_start TEXT NOT NULL,
-                lease_end TEXT NOT NULL,
-                payment_method TEXT DEFAULT '月繳',
-                has_discount INTEGER DEFAULT 0,
-                has_water_fee INTEGER DEFAULT 0,
-                discount_notes TEXT,
-                last_ac_cleaning_date TEXT,
-                annual_discount_months INTEGER DEFAULT 0,
-                annual_discount_amount REAL DEFAULT 0,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS payment_schedule (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_number TEXT NOT NULL,
-                tenant_name TEXT NOT NULL,
-                payment_year INTEGER NOT NULL,
-                payment_month INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                payment_method TEXT DEFAULT '月繳',
-                due_date TEXT,
-                paid_date TEXT,
-                paid_amount REAL DEFAULT 0,
-                status TEXT DEFAULT '未繳',
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(room_number) REFERENCES tenants(room_number),
-                UNIQUE(room_number, payment_year, payment_month)
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS rent_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_number TEXT NOT NULL,
-                tenant_name TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                month INTEGER NOT NULL,
-                base_amount REAL NOT NULL,
-                water_fee REAL DEFAULT 0,
-                discount_amount REAL DEFAULT 0,
-                actual_amount REAL NOT NULL,
-                paid_amount REAL DEFAULT 0,
-                paid_date TEXT,
-                payment_method TEXT,
-                notes TEXT,
-                status TEXT DEFAULT '待確認',
-                recorded_by TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(room_number) REFERENCES tenants(room_number),
-                UNIQUE(room_number, year, month)
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS rent_payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_number TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                month INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                paid_date TEXT,
-                is_paid INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(room_number) REFERENCES tenants(room_number),
-                UNIQUE(room_number, year, month)
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS electricity_period (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period_year INTEGER NOT NULL,
-                period_month_start INTEGER NOT NULL,
-                period_month_end INTEGER NOT NULL,
-                tdy_total_kwh REAL DEFAULT 0,
-                tdy_total_fee REAL DEFAULT 0,
-                unit_price REAL DEFAULT 0,
-                public_kwh REAL DEFAULT 0,
-                public_per_room INTEGER DEFAULT 0,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS electricity_tdy_bill (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period_id INTEGER NOT NULL,
-                floor_name TEXT NOT NULL,
-                tdy_total_kwh REAL NOT NULL,
-                tdy_total_fee REAL NOT NULL,
-                FOREIGN KEY(period_id) REFERENCES electricity_period(id),
-                UNIQUE(period_id, floor_name)
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS electricity_meter (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period_id INTEGER NOT NULL,
-                room_number TEXT NOT NULL,
-                meter_start_reading REAL NOT NULL,
-                meter_end_reading REAL NOT NULL,
-                meter_kwh_usage REAL NOT NULL,
-                FOREIGN KEY(period_id) REFERENCES electricity_period(id),
-                UNIQUE(period_id, room_number)
-            )""")
-            
-            cursor.execute("""CREATE TABLE IF NOT EXISTS electricity_calculation (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period_id INTEGER NOT NULL,
-                room_number TEXT NOT NULL,
-                private_kwh REAL NOT NULL,
-                public_kwh INTEGER NOT NULL,
-                total_kwh REAL NOT NULL,
-                unit_price REAL NOT NULL,
-                calculated_fee REAL NOT NULL,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(period_id) REFERENCES electricity_period(id),
-                UNIQUE(period_id, room_number)
-            )""")
+    @contextlib.contextmanager
+    def _get_write_connection(self):
+        with self._write_lock:
+            if self._write_conn is None:
+                self._write_conn = self._connect(isolation_level=None)
+            conn = self._write_conn
+            changes = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"數據庫寫入失敗: {e}")
+                # SQLITE_FULL/IOERR 等錯誤時 SQLite 可能已自行回滾，再下 ROLLBACK 會蓋掉原本的例外
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            if conn.total_changes != changes:
+                self._bump_version()
+
+    @staticmethod
+    def _close_conn(conn):
+        try:
+            # 關閉前更新查詢規劃統計，避免資料成長後索引選擇失準；analysis_limit 限制每個索引的抽樣量
+            conn.execute("PRAGMA analysis_limit = 400")
+            conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            logger.warning(f"PRAGMA optimize 失敗: {e}")
+        conn.close()
+
+    def _close_connections(self) -> bool:
+        # 只能關閉池中閒置的連線；回傳是否已全部關閉 (沒有仍被借用中的讀取連線)
+        with self._pool_lock:
+            while True:
+                try:
+                    self._close_conn(self._pool.get_nowait())
+                except queue.Empty:
+                    break
+                self._pool_opened -= 1
+            all_closed = self._pool_opened == 0
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._close_conn(self._write_conn)
+                self._write_conn = None
+        return all_closed
+
+    def _bump_version(self):
+        self._ver += 1
+        self._memo.clear()
+        if self._on_change is not None:
+            self._on_change()
+
+    def _memoized(self, loader, *args):
+        # 回傳的是共用物件，呼叫端不可就地修改
+        key = (loader.__name__,) + args
+        ver = self._ver
+        hit = self._memo.get(key)
+        if hit is not None and hit[0] == ver:
+            return hit[1]
+        value = loader(*args)
+        if self._ver == ver:
+            self._memo[key] = (ver, value)
+        return value
+
+    @staticmethod
+    def _fetch_df(conn, sql: str, params=(), columns=None) -> pd.DataFrame:
+        # 小結果集直接 fetchall 建表，省去 pd.read_sql 的額外開銷
+        cursor = conn.execute(sql, params)
+        rows = cursor.fetchall()
+        if columns is None:
+            columns = [d[0] for d in cursor.description]
+        return pd.DataFrame(rows, columns=list(columns))
+
+    def _init_db(self, conn):
+        conn.executescript(_TABLE_DDL)
+        logger.info("數據庫初始化完成")
+
+    def _force_fix_schema(self, conn) -> bool:
+        try:
+            # 一次查詢讀完所有表的欄位，再把缺的 ALTER 放進同一個交易，要嘛全成功要嘛全回滾
+            existing = set(conn.execute("""SELECT m.name, p.name FROM sqlite_master m, pragma_table_info(m.name) p
+                                           WHERE m.type='table'"""))
+            pending = [ddl for table, col, ddl in _SCHEMA_FIXES if (table, col) not in existing]
             
-            cursor.execute("""CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                expense_date TEXT NOT NULL,
-                category TEXT NOT NULL,
-                amount REAL NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for ddl in pending:
+                conn.execute(ddl)
+            conn.execute("UPDATE payment_schedule SET due_epoch=CAST(strftime('%s', due_date) AS INTEGER) WHERE due_epoch IS NULL AND due_date IS NOT NULL")
+            conn.execute("UPDATE payment_schedule SET paid_epoch=CAST(strftime('%s', paid_date) AS INTEGER) WHERE paid_epoch IS NULL AND paid_date IS NOT NULL")
+            conn.commit()
             
-            cursor.execute("""CREATE TABLE IF NOT EXISTS memos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                memo_text TEXT NOT NULL,
-                priority TEXT DEFAULT 'normal',
-                is_completed INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
-            logger.info("數據庫初始化完成")
-
-    def _force_fix_schema(self):
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA table_info(tenants)")
-                cols = [i[1] for i in cursor.fetchall()]
-                
-                if "payment_method" not in cols:
-                    cursor.execute("ALTER TABLE tenants ADD COLUMN payment_method TEXT DEFAULT '月繳'")
-                if "discount_notes" not in cols:
-                    cursor.execute("ALTER TABLE tenants ADD COLUMN discount_notes TEXT DEFAULT ''")
-                if "last_ac_cleaning_date" not in cols:
-                    cursor.execute("ALTER TABLE tenants ADD COLUMN last_ac_cleaning_date TEXT")
-                if "has_discount" not in cols:
-                    cursor.execute("ALTER TABLE tenants ADD COLUMN has_discount INTEGER DEFAULT 0")
-                if "has_water_fee" not in cols:
-                    cursor.execute("ALTER TABLE tenants ADD COLUMN has_water_fee INTEGER DEFAULT 0")
-                
-                cursor.execute("PRAGMA table_info(rent_records)")
-                rr_cols = [i[1] for i in cursor.fetchall()]
-                if "status" not in rr_cols:
-                    cursor.execute("ALTER TABLE rent_records ADD COLUMN status TEXT DEFAULT '待確認'")
-                
-                cursor.execute("PRAGMA table_info(electricity_period)")
-                ep_cols = [i[1] for i in cursor.fetchall()]
-                if "notes" not in ep_cols:
-                    cursor.execute("ALTER TABLE electricity_period ADD COLUMN notes TEXT DEFAULT ''")
-                    
-                logger.info("數據庫 Schema 修復完成")
+            logger.info(f"數據庫 Schema 修復完成 (新增 {len(pending)} 欄)")
+            return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"Schema 修復失敗: {e}")
+            return False
 
     def room_exists(self, room: str) -> bool:
+        # 以版本號快取的已出租房號集合判斷，重複查詢不再來回 SQLite；寫入交易內仍用 _Q_ROOM_EXISTS 即時檢查
+        return room in self._memoized(self._query_active_rooms)
+
+    def _query_active_rooms(self) -> frozenset:
         with self._get_connection() as conn:
-            return conn.execute("SELECT 1 FROM tenants WHERE room_number=? AND is_active=1", (room,)).fetchone() is not None
+            return frozenset(r[0] for r in conn.execute(_Q_ACTIVE_ROOMS))
 
     def upsert_tenant(self, room, name, phone, deposit, base_rent, start, end, payment_method="月繳", has_discount=False, has_water_fee=False, discount_notes="", annual_discount_months=0, ac_date=None, tenant_id=None):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 if tenant_id:
                     conn.execute("""UPDATE tenants SET tenant_name=?, phone=?, deposit=?, base_rent=?, lease_start=?, lease_end=?, payment_method=?, has_discount=?, has_water_fee=?, discount_notes=?, annual_discount_months=?, annual_discount_amount=?, last_ac_cleaning_date=? WHERE id=?""", 
                                 (name, phone, deposit, base_rent, start, end, payment_method, 1 if has_discount else 0, 1 if has_water_fee else 0, discount_notes, annual_discount_months, 0, ac_date, tenant_id))
                     logger.info(f"房客更新: {room} ({name})")
                     return True, f"✅ 房號 {room} 已更新"
                 else:
-                    if self.room_exists(room):
+                    if conn.execute(_Q_ROOM_EXISTS, (room,)).fetchone() is not None:
                         return False, f"❌ 房號 {room} 已存在"
                     
                     conn.execute("""INSERT INTO tenants(room_number, tenant_name, phone, deposit, base_rent, lease_start, lease_end, payment_method, has_discount, has_water_fee, discount_notes, annual_discount_months, annual_discount_amount, last_ac_cleaning_date) 
-                                 VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                                (room, name, phone, deposit, base_rent, start, end, payment_method, 1 if has_discount else 0, 1 if has_water_fee else 0, discount_notes, ac_date))
+                                 VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                (room, name, phone, deposit, base_rent, start, end, payment_method, 1 if has_discount else 0, 1 if has_water_fee else 0, discount_notes, annual_discount_months, 0, ac_date))
                     
-                    self._generate_payment_schedule_for_tenant(room, name, base_rent, has_water_fee, payment_method, start, end)
+                    # 繳費計畫與房客寫入同一個交易，避免第二個連線等待寫鎖
+                    self._generate_payment_schedule_for_tenant(conn, room, name, base_rent, has_water_fee, payment_method, start, end)
                     logger.info(f"房客新增: {room} ({name}) - {payment_method}")
                     return True, f"✅ 房號 {room} 已新增 (已自動生成繳費計畫)"
         except Exception as e:
             logger.error(f"房客操作失敗: {e}")
             return False, str(e)
 
-    def _generate_payment_schedule_for_tenant(self, room: str, tenant_name: str, base_rent: float, has_water_fee: bool, payment_method: str, start_date: str, end_date: str):
+    def bulk_upsert_tenants(self, rows):
+        # rows: (房號, 房客, 租金, 起租日, 到期日)；整批一個交易。已出租的房號略過，已退租的房號換成新房客重新啟用
+        try:
+            rows = list(rows)
+            with self._get_write_connection() as conn:
+                active = {r[0] for r in conn.execute(_Q_ACTIVE_ROOMS)}
+                inactive = {r[0] for r in conn.execute("SELECT room_number FROM tenants WHERE is_active=0")}
+                pending = [r for r in rows if r[0] not in active]
+                conn.executemany("INSERT INTO tenants(room_number, tenant_name, base_rent, lease_start, lease_end) VALUES(?, ?, ?, ?, ?)",
+                                 [r for r in pending if r[0] not in inactive])
+                reactivated = [r for r in pending if r[0] in inactive]
+                # 重新啟用時清掉前任房客的個人欄位與未繳排程，新排程才不會混入舊資料
+                conn.executemany("""UPDATE tenants SET tenant_name=?, base_rent=?, lease_start=?, lease_end=?, phone='', deposit=0,
+                                        payment_method='月繳', has_water_fee=0, has_discount=0, discount_notes=NULL,
+                                        annual_discount_months=0, annual_discount_amount=0, last_ac_cleaning_date=NULL, is_active=1
+                                    WHERE room_number=? AND is_active=0""",
+                                 [(name, rent, start, end, room) for room, name, rent, start, end in reactivated])
+                conn.executemany("DELETE FROM payment_schedule WHERE room_number=? AND status='未繳'", [(r[0],) for r in reactivated])
+                for room, name, rent, start, end in pending:
+                    self._generate_payment_schedule_for_tenant(conn, room, name, rent, False, "月繳", start, end)
+            skipped = len(rows) - len(pending)
+            logger.info(f"房客批次匯入: {len(pending)} 筆，略過已出租 {skipped} 筆")
+            return True, f"✅ 成功匯入 {len(pending)} 筆" + (f" (略過已出租 {skipped} 筆)" if skipped else "")
+        except Exception as e:
+            logger.error(f"房客批次匯入失敗: {e}")
+            return False, str(e)
+
+    def _generate_payment_schedule_for_tenant(self, conn, room: str, tenant_name: str, base_rent: float, has_water_fee: bool, payment_method: str, start_date: str, end_date: str):
         try:
             amount = base_rent + (WATER_FEE if has_water_fee else 0)
             schedule = generate_payment_schedule(payment_method, start_date, end_date)
-            with self._get_connection() as conn:
-                for year, month in schedule:
-                    if month == 12:
-                        due_date = f"{year + 1}-01-05"
-                    else:
-                        due_date = f"{year}-{month + 1:02d}-05"
-                    
-                    conn.execute("""INSERT OR IGNORE INTO payment_schedule (room_number, tenant_name, payment_year, payment_month, amount, payment_method, due_date, status, created_at, updated_at) 
-                                 VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                                (room, tenant_name, year, month, amount, payment_method, due_date, "未繳", datetime.now().strftime("%Y-%m-%d %H:%M:%S"), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            rows = []
+            for year, month in schedule:
+                if month == 12:
+                    due = date(year + 1, 1, 5)
+                else:
+                    due = date(year, month + 1, 5)
+                rows.append((room, tenant_name, year, month, amount, payment_method, due.isoformat(), to_epoch(due), "未繳", now_str, now_str))
+            
+            conn.executemany("""INSERT OR IGNORE INTO payment_schedule (room_number, tenant_name, payment_year, payment_month, amount, payment_method, due_date, due_epoch, status, created_at, updated_at) 
+                             VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
         except Exception as e:
             logger.error(f"生成繳費計畫失敗: {e}")
+            raise
 
     def get_tenants(self) -> pd.DataFrame:
+        return self._memoized(self._query_tenants)
+
+    def _query_tenants(self) -> pd.DataFrame:
         with self._get_connection() as conn:
-            return pd.read_sql("SELECT * FROM tenants WHERE is_active=1 ORDER BY room_number", conn)
+            return self._read_tenants(conn)
+
+    def _read_tenants(self, conn) -> pd.DataFrame:
+        df = self._fetch_df(conn, _Q_TENANTS, columns=TENANT_COLUMNS)
+        # 租約日期在讀取時就轉成 datetime64，頁面端不必再逐列 strptime；格式錯誤的變成 NaT
+        for col in ('lease_start', 'lease_end'):
+            df[col] = pd.to_datetime(df[col], format="%Y-%m-%d", errors='coerce')
+        return df
 
     def get_tenant_by_id(self, tid: int):
         try:
             with self._get_connection() as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.execute("SELECT * FROM tenants WHERE id=?", (tid,))
-                row = cursor.fetchone()
+                # row_factory 設在游標上，不改動池中共用連線的設定
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                row = cursor.execute("SELECT * FROM tenants WHERE id=?", (tid,)).fetchone()
                 if row:
                     return dict(row)
                 return None
@@ -510,7 +830,7 @@ class RentalDB:
 
     def delete_tenant(self, tid: int):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 conn.execute("UPDATE tenants SET is_active=0 WHERE id=?", (tid,))
                 logger.info(f"房客刪除: ID {tid}")
                 return True, "✅ 已刪除"
@@ -520,7 +840,8 @@ class RentalDB:
 
     def get_payment_schedule(self, room: Optional[str] = None, status: Optional[str] = None, year: Optional[int] = None) -> pd.DataFrame:
         with self._get_connection() as conn:
-            q = "SELECT * FROM payment_schedule WHERE 1=1"
+            q = """SELECT id, room_number, tenant_name, payment_year, payment_month, amount, payment_method, due_date, status, paid_date
+                   FROM payment_schedule WHERE 1=1"""
             params = []
             
             if room:
@@ -534,13 +855,13 @@ class RentalDB:
                 params.append(year)
             
             q += " ORDER BY payment_year DESC, payment_month DESC, room_number"
-            return pd.read_sql(q, conn, params=params)
+            return self._fetch_df(conn, q, params)
 
     def mark_payment_done(self, payment_id: int, paid_date: str, paid_amount: float, notes: str = ""):
         try:
-            with self._get_connection() as conn:
-                conn.execute("""UPDATE payment_schedule SET status='已繳', paid_date=?, paid_amount=?, notes=?, updated_at=? WHERE id=?""",
-                           (paid_date, paid_amount, notes, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id))
+            with self._get_write_connection() as conn:
+                conn.execute(_Q_MARK_PAYMENT_DONE,
+                           (paid_date, to_epoch(datetime.strptime(paid_date, "%Y-%m-%d").date()), paid_amount, notes, payment_id))
                 logger.info(f"繳費標記: ID {payment_id} 已繳 ${paid_amount}")
                 return True, "✅ 繳費已標記"
         except Exception as e:
@@ -548,45 +869,60 @@ class RentalDB:
             return False, f"❌ 失敗: {str(e)}"
 
     def get_payment_summary(self, year: int) -> Dict:
+        return self._memoized(self._query_payment_summary, year)
+
+    def _query_payment_summary(self, year: int) -> Dict:
         with self._get_connection() as conn:
-            due = conn.execute("SELECT SUM(amount) FROM payment_schedule WHERE payment_year=?", (year,)).fetchone()[0] or 0
-            paid = conn.execute("SELECT SUM(paid_amount) FROM payment_schedule WHERE payment_year=? AND status='已繳'", (year,)).fetchone()[0] or 0
-            unpaid = conn.execute("SELECT COUNT(*) FROM payment_schedule WHERE payment_year=? AND status='未繳'", (year,)).fetchone()[0] or 0
-            return {'total_due': due, 'total_paid': paid, 'unpaid_count': unpaid, 'collection_rate': (paid/due*100) if due > 0 else 0}
+            return self._read_payment_summary(conn, year)
+
+    def _read_payment_summary(self, conn, year: int) -> Dict:
+        due, paid, unpaid = conn.execute(_Q_PAYMENT_SUMMARY, (year,)).fetchone()
+        return {'total_due': due, 'total_paid': paid, 'unpaid_count': unpaid, 'collection_rate': (paid/due*100) if due > 0 else 0}
 
     def get_overdue_payments(self) -> pd.DataFrame:
-        today = date.today().strftime("%Y-%m-%d")
         with self._get_connection() as conn:
-            return pd.read_sql(f"""SELECT room_number, tenant_name, payment_month, amount, due_date 
-                                FROM payment_schedule WHERE status='未繳' AND due_date < ?
-                                ORDER BY due_date ASC""", conn, params=(today,))
+            return self._read_overdue_payments(conn, date.today())
+
+    def _read_overdue_payments(self, conn, today: date) -> pd.DataFrame:
+        return self._fetch_df(conn, """SELECT room_number, tenant_name, payment_month, amount, due_date 
+                            FROM payment_schedule WHERE status='未繳' AND due_epoch < ?
+                            ORDER BY due_epoch ASC""", (to_epoch(today),))
 
     def get_upcoming_payments(self, days_ahead: int = 7) -> pd.DataFrame:
-        today = date.today()
-        future_date = (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-        today_str = today.strftime("%Y-%m-%d")
         with self._get_connection() as conn:
-            return pd.read_sql(f"""SELECT room_number, tenant_name, payment_month, amount, due_date 
-                                FROM payment_schedule WHERE status='未繳' AND due_date >= ? AND due_date <= ?
-                                ORDER BY due_date ASC""", conn, params=(today_str, future_date))
+            return self._read_upcoming_payments(conn, date.today(), days_ahead)
+
+    def _read_upcoming_payments(self, conn, today: date, days_ahead: int) -> pd.DataFrame:
+        return self._fetch_df(conn, """SELECT room_number, tenant_name, payment_month, amount, due_date 
+                            FROM payment_schedule WHERE status='未繳' AND due_epoch >= ? AND due_epoch <= ?
+                            ORDER BY due_epoch ASC""", (to_epoch(today), to_epoch(today + timedelta(days=days_ahead))))
+
+    def get_dashboard_bundle(self, year: int, today: date) -> Dict:
+        # 儀表板需要的唯讀查詢共用一條連線、包在同一個讀取交易裡，看到的是同一份快照
+        with self._get_connection() as conn:
+            conn.execute("BEGIN")
+            return {
+                'tenants': self._read_tenants(conn),
+                'overdue': self._read_overdue_payments(conn, today),
+                'upcoming': self._read_upcoming_payments(conn, today, 7),
+                'summary': self._read_payment_summary(conn, year),
+                'unpaid': self._read_unpaid_rents(conn),
+            }
 
     def batch_record_rent(self, room: str, tenant_name: str, start_year: int, start_month: int, months_count: int, base_rent: float, water_fee: float, discount: float, payment_method: str = "月繳", notes: str = ""):
         try:
-            with self._get_connection() as conn:
-                actual_amount = base_rent + water_fee - discount
-                current_date = date(start_year, start_month, 1)
-                
-                for i in range(months_count):
-                    year = current_date.year
-                    month = current_date.month
-                    conn.execute("""INSERT OR REPLACE INTO rent_records (room_number, tenant_name, year, month, base_amount, water_fee, discount_amount, actual_amount, paid_amount, payment_method, notes, status, recorded_by, updated_at) 
-                                 VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                                (room, tenant_name, year, month, base_rent, water_fee, discount, actual_amount, 0, payment_method, notes, "待確認", "batch", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-                    
-                    if month == 12:
-                        current_date = date(year + 1, 1, 1)
-                    else:
-                        current_date = date(year, month + 1, 1)
+            actual_amount = base_rent + water_fee - discount
+            rows = []
+            year, month = start_year, start_month
+            for _ in range(months_count):
+                rows.append((room, tenant_name, year, month, base_rent, water_fee, discount, actual_amount, 0, payment_method, notes, "待確認", "batch"))
+                if month == 12:
+                    year, month = year + 1, 1
+                else:
+                    month += 1
+            
+            with self._get_write_connection() as conn:
+                conn.executemany(_Q_UPSERT_RENT_RECORD, rows)
                 
                 logger.info(f"批量預填租金: {room} {start_year}年{start_month}月 {months_count}個月")
                 return True, f"✅ 已預填 {months_count} 個月租金"
@@ -596,77 +932,97 @@ class RentalDB:
 
     def confirm_rent_payment(self, rent_id: int, paid_date: str, paid_amount: float = None):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 row = conn.execute("SELECT actual_amount FROM rent_records WHERE id=?", (rent_id,)).fetchone()
                 if not row:
                     return False, "❌ 找不到該筆記錄"
                 
                 actual = row[0]
                 paid_amt = paid_amount if paid_amount is not None else actual
-                conn.execute("""UPDATE rent_records SET status='已收', paid_date=?, paid_amount=?, updated_at=? WHERE id=?""",
-                           (paid_date, paid_amt, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), rent_id))
+                conn.execute(_Q_CONFIRM_RENT,
+                           (paid_date, paid_amt, rent_id))
                 logger.info(f"確認租金繳費: ID {rent_id} 已收 ${paid_amt}")
                 return True, "✅ 租金已確認繳清"
         except Exception as e:
             logger.error(f"確認失敗: {e}")
             return False, f"❌ 失敗: {str(e)}"
 
-    def get_rent_records(self, year=None, month=None, status=None) -> pd.DataFrame:
+    def get_rent_records(self, year=None, month=None, status=None, after: Optional[Tuple[int, int, str]] = None, limit: Optional[int] = None) -> pd.DataFrame:
         with self._get_connection() as conn:
-            q = "SELECT * FROM rent_records"
+            q = """SELECT id, year, month, room_number, tenant_name, actual_amount, paid_amount, status, paid_date
+                   FROM rent_records"""
             conds = []
+            params = []
             if year:
-                conds.append(f"year={year}")
+                conds.append("year=?")
+                params.append(year)
             if month and month != "全部":
-                conds.append(f"month={month}")
+                conds.append("month=?")
+                params.append(month)
             if status:
-                conds.append(f"status='{status}'")
+                conds.append("status=?")
+                params.append(status)
+            if after:
+                # 鍵集分頁：從上一頁最後一筆 (年, 月, 房號) 之後接著讀，不用 OFFSET 重掃前面各頁
+                y, m, room = after
+                conds.append("((year, month) < (?, ?) OR (year=? AND month=? AND room_number > ?))")
+                params.extend((y, m, y, m, room))
             if conds:
                 q += " WHERE " + " AND ".join(conds)
             q += " ORDER BY year DESC, month DESC, room_number"
-            return pd.read_sql(q, conn)
+            if limit:
+                q += " LIMIT ?"
+                params.append(limit)
+            return self._fetch_df(conn, q, params)
 
     def get_pending_rents(self) -> pd.DataFrame:
         with self._get_connection() as conn:
-            return pd.read_sql("""SELECT id, room_number, tenant_name, year, month, actual_amount, status 
+            return self._fetch_df(conn, """SELECT id, room_number, tenant_name, year, month, actual_amount, status 
                                FROM rent_records WHERE status IN ('待確認', '未收') 
-                               ORDER BY year DESC, month DESC, room_number""", conn)
+                               ORDER BY year DESC, month DESC, room_number""")
 
     def get_unpaid_rents_v2(self) -> pd.DataFrame:
         with self._get_connection() as conn:
-            return pd.read_sql("""SELECT room_number as '房號', tenant_name as '房客', year as '年', month as '月', actual_amount as '應繳', paid_amount as '已收', status as '狀態' 
-                               FROM rent_records WHERE status='未收' ORDER BY year DESC, month DESC, room_number""", conn)
+            return self._fetch_df(conn, """SELECT room_number as '房號', tenant_name as '房客', year as '年', month as '月', actual_amount as '應繳', paid_amount as '已收', status as '狀態' 
+                               FROM rent_records WHERE status='未收' ORDER BY year DESC, month DESC, room_number""")
 
     def get_rent_summary(self, year: int) -> Dict:
+        return self._memoized(self._query_rent_summary, year)
+
+    def _query_rent_summary(self, year: int) -> Dict:
         with self._get_connection() as conn:
-            due = conn.execute("SELECT SUM(actual_amount) FROM rent_records WHERE year=?", (year,)).fetchone()[0] or 0
-            paid = conn.execute("SELECT SUM(paid_amount) FROM rent_records WHERE year=? AND status='已收'", (year,)).fetchone()[0] or 0
-            unpaid = conn.execute("SELECT SUM(actual_amount) FROM rent_records WHERE year=? AND status IN ('未收', '待確認')", (year,)).fetchone()[0] or 0
+            due, paid, unpaid = conn.execute(_Q_RENT_SUMMARY, (year,)).fetchone()
             return {'total_due': due, 'total_paid': paid, 'total_unpaid': unpaid, 'collection_rate': (paid/due*100) if due > 0 else 0}
 
     def get_rent_matrix(self, year: int) -> pd.DataFrame:
         with self._get_connection() as conn:
-            df = pd.read_sql(f"SELECT room_number, month, is_paid, amount FROM rent_payments WHERE year = ? ORDER BY room_number, month", conn, params=(year,))
+            # 舊的 rent_payments 表已無任何寫入，繳費狀態一律以 rent_records 為準
+            df = pd.read_sql("""SELECT room_number, month, status='已收' AS is_paid, actual_amount AS amount
+                                FROM rent_records WHERE year = ? ORDER BY room_number, month""", conn, params=(year,))
             if df.empty:
                 return pd.DataFrame()
             
-            matrix = {r: {m: "" for m in range(1, 13)} for r in ALL_ROOMS}
-            for _, row in df.iterrows():
-                matrix[row['room_number']][row['month']] = "✅" if row['is_paid'] else f"❌ ${int(row['amount'])}"
-            
-            res = pd.DataFrame.from_dict(matrix, orient='index')
+            df['cell'] = np.where(df['is_paid'] == 1, "✅", "❌ $" + df['amount'].astype(int).astype(str))
+            # unstack 與 reindex 直接以 fill_value 補空格，不必再對整張 object 表跑一次 fillna
+            res = (df.set_index(['room_number', 'month'])['cell']
+                     .unstack(fill_value="")
+                     .reindex(index=ALL_ROOMS, columns=range(1, 13), fill_value=""))
+            res.index.name = None
             res.columns = [f"{m}月" for m in range(1, 13)]
             return res
 
     def get_unpaid_rents(self) -> pd.DataFrame:
         with self._get_connection() as conn:
-            return pd.read_sql("""SELECT r.room_number as '房號', t.tenant_name as '房客', r.year as '年', r.month as '月', r.amount as '金額' 
-                               FROM rent_payments r JOIN tenants t ON r.room_number = t.room_number 
-                               WHERE r.is_paid = 0 AND t.is_active = 1 ORDER BY r.year DESC, r.month DESC""", conn)
+            return self._read_unpaid_rents(conn)
+
+    def _read_unpaid_rents(self, conn) -> pd.DataFrame:
+        return pd.read_sql("""SELECT r.room_number as '房號', t.tenant_name as '房客', r.year as '年', r.month as '月', r.actual_amount as '金額' 
+                           FROM rent_records r JOIN tenants t ON r.room_number = t.room_number 
+                           WHERE r.status IN ('未收', '待確認') AND t.is_active = 1 ORDER BY r.year DESC, r.month DESC""", conn)
 
     def add_electricity_period(self, year, ms, me):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 if conn.execute("SELECT 1 FROM electricity_period WHERE period_year=? AND period_month_start=? AND period_month_end=?", (year, ms, me)).fetchone():
                     return True, "✅ 期間已存在", 0
                 
@@ -679,7 +1035,9 @@ class RentalDB:
 
     def get_all_periods(self):
         with self._get_connection() as conn:
-            c = conn.execute("SELECT * FROM electricity_period ORDER BY id DESC")
+            # 只取歷史頁會用到的欄位；依主鍵倒序，SQLite 直接反向走 rowid 不需另外排序
+            c = conn.execute("""SELECT id, period_year, period_month_start, period_month_end, tdy_total_kwh, tdy_total_fee, unit_price, public_kwh, notes
+                                FROM electricity_period ORDER BY id DESC""")
             columns = [d[0] for d in c.description]
             results = [dict(zip(columns, r)) for r in c.fetchall()]
             c.close()
@@ -691,56 +1049,65 @@ class RentalDB:
                                FROM electricity_calculation WHERE period_id = ? ORDER BY room_number""", conn, params=(pid,))
 
     def add_tdy_bill(self, pid, floor, kwh, fee):
-        with self._get_connection() as conn:
-            conn.execute("INSERT OR REPLACE INTO electricity_tdy_bill(period_id, floor_name, tdy_total_kwh, tdy_total_fee) VALUES(?, ?, ?, ?)",
-                        (pid, floor, kwh, fee))
+        return self.add_tdy_bills_batch(pid, [(floor, kwh, fee)])
+
+    def add_tdy_bills_batch(self, pid, bills):
+        # bills: [(樓層, 度數, 金額)]；整批一個交易、一次 executemany
+        try:
+            with self._get_write_connection() as conn:
+                conn.executemany(_Q_UPSERT_TDY_BILL, [(pid, floor, kwh, fee) for floor, kwh, fee in bills])
+                return True, f"✅ 已儲存 {len(bills)} 筆台電單據"
+        except Exception as e:
+            logger.error(f"儲存台電單據失敗: {e}")
+            return False, f"❌ 失敗: {str(e)}"
 
     def add_meter_reading(self, pid, room, start, end):
-        with self._get_connection() as conn:
-            conn.execute("INSERT OR REPLACE INTO electricity_meter(period_id, room_number, meter_start_reading, meter_end_reading, meter_kwh_usage) VALUES(?, ?, ?, ?, ?)",
-                        (pid, room, start, end, round(end-start, 2)))
+        return self.add_meter_readings_batch(pid, [(room, start, end)])
+
+    def add_meter_readings_batch(self, pid, readings):
+        # readings: [(房號, 開始度數, 結束度數)]
+        try:
+            with self._get_write_connection() as conn:
+                conn.executemany(_Q_UPSERT_METER, [(pid, room, start, end, round(end - start, 2)) for room, start, end in readings])
+                return True, f"✅ 已儲存 {len(readings)} 筆度數"
+        except Exception as e:
+            logger.error(f"儲存度數失敗: {e}")
+            return False, f"❌ 失敗: {str(e)}"
 
     def calculate_electricity_fee(self, pid, calc, meter_data, notes=""):
         try:
-            results = []
-            with self._get_connection() as conn:
-                for room in SHARING_ROOMS:
-                    s, e = meter_data[room]
-                    if e <= s:
-                        continue
-                    
-                    priv = round(e - s, 2)
-                    pub = calc.public_per_room
-                    total = round(priv + pub, 2)
-                    fee = round(total * calc.unit_price, 0)
-                    
-                    results.append({
-                        '房號': room,
-                        '私表度數': f"{priv:.2f}",
-                        '分攤度數': str(pub),
-                        '合計度數': f"{total:.2f}",
-                        '電度單價': f"${calc.unit_price:.4f}/度",
-                        '應繳電費': f"${int(fee)}"
-                    })
-                    
-                    conn.execute("""INSERT OR REPLACE INTO electricity_calculation(period_id, room_number, private_kwh, public_kwh, total_kwh, unit_price, calculated_fee) 
-                                 VALUES(?, ?, ?, ?, ?, ?, ?)""",
-                                (pid, room, priv, pub, total, calc.unit_price, fee))
+            calc_rows = []
+            pub = calc.public_per_room
+            for room in SHARING_ROOMS:
+                s, e = meter_data[room]
+                if e <= s:
+                    continue
                 
+                priv = round(e - s, 2)
+                total = round(priv + pub, 2)
+                fee = round(total * calc.unit_price, 0)
+                calc_rows.append((pid, room, priv, pub, total, calc.unit_price, fee))
+            
+            with self._get_write_connection() as conn:
+                conn.executemany("""INSERT INTO electricity_calculation(period_id, room_number, private_kwh, public_kwh, total_kwh, unit_price, calculated_fee) 
+                                 VALUES(?, ?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT(period_id, room_number) DO UPDATE SET private_kwh=excluded.private_kwh, public_kwh=excluded.public_kwh,
+                                     total_kwh=excluded.total_kwh, unit_price=excluded.unit_price, calculated_fee=excluded.calculated_fee""", calc_rows)
                 conn.execute("""UPDATE electricity_period SET unit_price=?, public_kwh=?, public_per_room=?, tdy_total_kwh=?, tdy_total_fee=?, notes=? WHERE id=?""",
                            (calc.unit_price, calc.public_kwh, calc.public_per_room, calc.tdy_total_kwh, calc.tdy_total_fee, notes, pid))
             
             logger.info(f"電費計算完成: 期間 ID {pid}")
-            return True, "✅ 計算完成", pd.DataFrame(results)
+            # 結果保留數值欄位，顯示格式交給呼叫端的 Styler
+            results = pd.DataFrame([r[1:] for r in calc_rows], columns=['房號', '私表度數', '分攤度數', '合計度數', '電度單價', '應繳電費'])
+            return True, "✅ 計算完成", results
         except Exception as e:
             logger.error(f"電費計算失敗: {e}")
             return False, str(e), pd.DataFrame()
 
     def add_expense(self, date, cat, amt, desc):
         try:
-            with self._get_connection() as conn:
-                conn.execute("INSERT INTO expenses(expense_date, category, amount, description) VALUES(?, ?, ?, ?)",
-                           (date, cat, amt, desc))
+            with self._get_write_connection() as conn:
+                conn.execute(_Q_INSERT_EXPENSE, (date, cat, amt, desc))
                 logger.info(f"新增支出: {cat} - ${amt}")
                 return True
         except Exception as e:
@@ -749,11 +1116,11 @@ class RentalDB:
 
     def get_expenses(self, limit=50):
         with self._get_connection() as conn:
-            return pd.read_sql("SELECT * FROM expenses ORDER BY expense_date DESC LIMIT ?", conn, params=(limit,))
+            return self._fetch_df(conn, "SELECT * FROM expenses ORDER BY expense_date DESC LIMIT ?", (limit,))
 
     def add_memo(self, text, prio="normal"):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 conn.execute("INSERT INTO memos(memo_text, priority) VALUES(?, ?)", (text, prio))
                 logger.info(f"新增備忘: {text[:30]}...")
                 return True
@@ -763,11 +1130,12 @@ class RentalDB:
 
     def get_memos(self, completed=False):
         with self._get_connection() as conn:
-            return pd.read_sql("SELECT * FROM memos WHERE is_completed=? ORDER BY priority DESC, created_at DESC", conn, params=(1 if completed else 0,))
+            return self._fetch_df(conn, "SELECT id, memo_text, priority FROM memos WHERE is_completed=? ORDER BY priority DESC, created_at DESC",
+                                  (1 if completed else 0,))
 
     def complete_memo(self, mid):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 conn.execute("UPDATE memos SET is_completed=1 WHERE id=?", (mid,))
                 logger.info(f"備忘完成: ID {mid}")
                 return True
@@ -777,7 +1145,7 @@ class RentalDB:
 
     def delete_memo(self, mid):
         try:
-            with self._get_connection() as conn:
+            with self._get_write_connection() as conn:
                 conn.execute("DELETE FROM memos WHERE id=?", (mid,))
                 logger.info(f"刪除備忘: ID {mid}")
                 return True
@@ -789,111 +1157,326 @@ class RentalDB:
 # ============================================================================
 # UI 工具 (莫蘭迪護眼版)
 # ============================================================================
-def display_card(title: str, value: str, color: str = "blue"):
-    colors = {
-        "blue": "#f0f4f8",
-        "green": "#edf2f0",
-        "orange": "#fdf3e7",
-        "red": "#fbeaea"
-    }
-    
-    border_colors = {
-        "blue": "#98c1d9",
-        "green": "#99b898",
-        "orange": "#e0c3a5",
-        "red": "#e5989b"
-    }
-    
-    text_color = "#4a5568"
-    value_color = "#2d3748"
-    
-    st.markdown(f"""
-    <div style="
-        background: {colors.get(color, colors['blue'])};
-        border-radius: 10px;
-        padding: 16px;
-        margin-bottom: 12px;
-        border: 1px solid {border_colors.get(color, border_colors['blue'])};
-        border-left: 5px solid {border_colors.get(color, border_colors['blue'])};
-        box-shadow: 0 1px 2px rgba(0,0,0,0.05);
-    ">
-        <div style="color: {text_color}; font-size: 0.9rem; font-weight: 600; letter-spacing: 0.5px;">{title}</div>
-        <div style="color: {value_color}; font-size: 1.6rem; font-weight: 700; margin-top: 6px; font-family: Segoe UI, sans-serif;">{value}</div>
-    </div>
-    """, unsafe_allow_html=True)
-
-
-def display_room_card(room, status_color, status_text, detail_text):
-    bg_color = {"green": "#eaf4e7", "red": "#fae3e3", "orange": "#fef5e6"}.get(status_color, "#f8f9fa")
-    text_color = {"green": "#2f5d34", "red": "#8a2c2c", "orange": "#8a5a2c"}.get(status_color, "#4a5568")
-    
-    st.markdown(f"""
-    <div style="
-        background-color: {bg_color};
-        border-radius: 12px;
-        padding: 12px;
-        text-align: center;
-        height: 100px;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        align-items: center;
-        margin-bottom: 10px;
-        box-shadow: 0 1px 3px rgba(0,0,0,0.05);
-    ">
-        <div style="font-size: 1.3rem; font-weight: 700; color: {text_color};">{room}</div>
-        <div style="font-size: 0.9rem; font-weight: 600; color: {text_color}; margin-top: 4px;">{status_text}</div>
-        <div style="font-size: 0.75rem; color: {text_color}; opacity: 0.8;">{detail_text}</div>
-    </div>
-    """, unsafe_allow_html=True)
+# KPI 卡片配色: 顏色 -> (背景, 邊框)
+_CARD_PALETTE = {
+    "blue": ("#f0f4f8", "#98c1d9"),
+    "green": ("#edf2f0", "#99b898"),
+    "orange": ("#fdf3e7", "#e0c3a5"),
+    "red": ("#fbeaea", "#e5989b"),
+}
+
+
+# 卡片文字顏色與字型
+_CARD_TEXT_COLOR = "#4a5568"
+_CARD_VALUE_COLOR = "#2d3748"
+_CARD_VALUE_FONT = "Segoe UI, sans-serif"
+
+
+# 房間卡片配色: 狀態 -> (背景, 文字)
+_ROOM_COLORS = {
+    "green": ("#eaf4e7", "#2f5d34"),
+    "red": ("#fae3e3", "#8a2c2c"),
+    "orange": ("#fef5e6", "#8a5a2c"),
+}
+_ROOM_DEFAULT = ("#f8f9fa", _CARD_TEXT_COLOR)
+
+
+def _build_card_css() -> str:
+    rules = [
+        ".rms-grid { display: grid; column-gap: 1rem; }",
+        ".rms-card { border-radius: 10px; padding: 16px; margin-bottom: 12px; border: 1px solid; border-left: 5px solid; box-shadow: 0 1px 2px rgba(0,0,0,0.05); }",
+        f".rms-card-t {{ color: {_CARD_TEXT_COLOR}; font-size: 0.9rem; font-weight: 600; letter-spacing: 0.5px; }}",
+        f".rms-card-v {{ color: {_CARD_VALUE_COLOR}; font-size: 1.6rem; font-weight: 700; margin-top: 6px; font-family: {_CARD_VALUE_FONT}; }}",
+        ".rms-room { border-radius: 12px; padding: 12px; text-align: center; height: 100px; display: flex; flex-direction: column; justify-content: center; align-items: center; margin-bottom: 10px; box-shadow: 0 1px 3px rgba(0,0,0,0.05); }",
+        ".rms-room-n { font-size: 1.3rem; font-weight: 700; }",
+        ".rms-room-s { font-size: 0.9rem; font-weight: 600; margin-top: 4px; }",
+        ".rms-room-d { font-size: 0.75rem; opacity: 0.8; }",
+    ]
+    for color, (bg, border) in _CARD_PALETTE.items():
+        rules.append(f".rms-card-{color} {{ background: {bg}; border-color: {border}; }}")
+    for status_color, (bg, text) in [*_ROOM_COLORS.items(), ("default", _ROOM_DEFAULT)]:
+        rules.append(f".rms-room-{status_color} {{ background-color: {bg}; color: {text}; }}")
+    # 原始規則保持可讀，輸出時去掉多餘空白壓成一行
+    return re.sub(r"\s*([{};:,])\s*", r"\1", "".join(rules)).replace(";}", "}")
+
+
+# 卡片樣式集中成一份樣式表；卡片本身只帶 class
+_CARD_CSS = _build_card_css()
+_APP_CSS = (".stApp{background-color:#f8f9fa;font-family:'微軟正黑體','Microsoft JhengHei',sans-serif;color:#2f3e46}"
+            "h1,h2,h3{color:#52796f;font-weight:700}"
+            "h4,h5,h6{color:#5c677d;font-weight:600}")
+# 全站與卡片樣式在載入時就組成單一 <style> 字串，main() 每次執行只送這一個元素
+# (Streamlit 會移除該輪沒再送出的元素，所以仍須每輪送出，不能只送一次)
+_PAGE_STYLE = f"<style>{_APP_CSS}{_CARD_CSS}</style>"
+_CARD_TMPL = '<div class="rms-card rms-card-{color}"><div class="rms-card-t">{title}</div><div class="rms-card-v">{value}</div></div>'
+
+# 卡片只有 HTML 沒有 Markdown 語法，有 st.html (>=1.33) 就跳過 markdown 解析
+_render_html = getattr(st, "html", None) or (lambda html: st.markdown(html, unsafe_allow_html=True))
+
+
+# 房客姓名、備註等文字會直接拼進 HTML，一律先跳脫
+_ESC = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+
+# 注意：卡片每次 rerun 都必須重新輸出 —— 未重送的元素會被前端移除，不能用「內容沒變就略過」的做法
+def _build_card_html(title: str, value: str, color: str) -> str:
+    return _CARD_TMPL.format_map({
+        "color": color if color in _CARD_PALETTE else "blue",
+        "title": title.translate(_ESC),
+        "value": value.translate(_ESC),
+    })
+
+
+def display_cards_batch(cards: List[tuple]):
+    # 一列 KPI 卡片合併成一次輸出，欄數與卡片數相同
+    html = "".join(_build_card_html(str(title), str(value), color) for title, value, color in cards)
+    _render_html(f'<div class="rms-grid" style="grid-template-columns: repeat({len(cards)}, 1fr);">{html}</div>')
+
+
+def display_room_dataframe(rooms_df: pd.DataFrame, columns: int = 6):
+    # rooms_df 欄位: room, status_color, status_text, detail_text；整棟一次以向量化字串拼出
+    if rooms_df.empty:
+        return
+    
+    def esc(col):
+        return rooms_df[col].astype(str).str.translate(_ESC)
+    
+    status = rooms_df['status_color'].where(rooms_df['status_color'].isin(list(_ROOM_COLORS)), "default")
+    cells = (
+        '<div class="rms-room rms-room-' + status + '"><div class="rms-room-n">' + esc('room')
+        + '</div><div class="rms-room-s">' + esc('status_text')
+        + '</div><div class="rms-room-d">' + esc('detail_text') + '</div></div>'
+    )
+    _render_html(f'<div class="rms-grid" style="grid-template-columns: repeat({columns}, 1fr);">{cells.str.cat()}</div>')
+
+
+# ============================================================================
+# 頁面讀取快取 (跨 rerun 共用，任何寫入都會經 get_db 掛上的 on_change 清空)
+# ============================================================================
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def _cached_dashboard_bundle(_db: RentalDB, stamp: str, year: int) -> Dict:
+    return _db.get_dashboard_bundle(year, date.fromisoformat(stamp))
+
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def _cached_rent_matrix(_db: RentalDB, year: int) -> pd.DataFrame:
+    return _db.get_rent_matrix(year)
+
+
+@st.cache_data(ttl=60, max_entries=128, show_spinner=False)
+def _cached_schedule(_db: RentalDB, room: Optional[str], status: Optional[str], year: Optional[int]) -> pd.DataFrame:
+    return _db.get_payment_schedule(room=room, status=status, year=year)
+
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _cached_periods(_db: RentalDB) -> Tuple[Dict[int, Dict], Dict[int, str]]:
+    # 以 id 為鍵 (保留 id DESC 順序)，選定期間時直接查表；下拉選單的標籤也一併建好
+    periods_by_id = {p['id']: p for p in _db.get_all_periods()}
+    period_labels = {pid: f"{p['period_year']}年 {p['period_month_start']}-{p['period_month_end']}月" for pid, p in periods_by_id.items()}
+    return periods_by_id, period_labels
+
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def _cached_period_report(_db: RentalDB, pid: int) -> pd.DataFrame:
+    return _db.get_period_report(pid)
+
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def _cached_expenses(_db: RentalDB, limit: int) -> pd.DataFrame:
+    return _db.get_expenses(limit)
+
+
+_READ_CACHES = (_cached_dashboard_bundle, _cached_rent_matrix, _cached_schedule, _cached_periods,
+                _cached_period_report, _cached_expenses)
+
+
+def _invalidate_read_caches():
+    for cached in _READ_CACHES:
+        cached.clear()
 
 
 # ============================================================================
 # 頁面函數
 # ============================================================================
 
+# 局部 rerun：按鈕只重跑所在區塊 (st.fragment 需 streamlit >= 1.37，舊版退回一般函式與整頁 rerun)
+_fragment = getattr(st, "fragment", None) or (lambda func: func)
+
+
+def _rerun_fragment():
+    # 舊版沒有 scope 參數，或目前不是 fragment 局部重跑時，退回整頁 rerun
+    try:
+        st.rerun(scope="fragment")
+    except (TypeError, StreamlitAPIException):
+        st.rerun()
+
+
+@_fragment
+def _memo_fragment(db: RentalDB):
+    memos = db.get_memos(completed=False)
+    if not memos.empty:
+        for memo in memos.itertuples(index=False):
+            c1, c2 = st.columns([5, 1])
+            c1.write(f"📌 {memo.memo_text}")
+            if c2.button("✓", key=f"m{memo.id}"):
+                db.complete_memo(memo.id)
+                _rerun_fragment()
+    else:
+        st.caption("無備忘事項")
+
+
+@_fragment
+def _rent_confirm_fragment(db: RentalDB):
+    pending = db.get_pending_rents()
+    if pending.empty:
+        st.success("✅ 無待確認租金")
+    else:
+        col_pending, col_confirmed = st.columns(2)
+        # 依狀態一次分組，不必對同一欄各掃一次
+        groups = dict(tuple(pending.groupby(pending['status'].eq('已收'), sort=False)))
+        pending_only = groups.get(False, pending.iloc[:0])
+        confirmed = groups.get(True, pending.iloc[:0])
+        
+        with col_pending:
+            st.subheader("⏳ 待確認")
+            
+            if not pending_only.empty:
+                for row in pending_only.itertuples(index=False):
+                    with st.container(border=True):
+                        col1, col2 = st.columns([3, 1])
+                        
+                        with col1:
+                            st.write(f"{row.room_number} {row.tenant_name}")
+                            st.caption(f"{row.year}年{row.month}月 - ${row.actual_amount:.0f}")
+                        
+                        with col2:
+                            if st.button("✅", key=f"confirm{row.id}", use_container_width=True):
+                                ok, msg = db.confirm_rent_payment(row.id, date.today().strftime("%Y-%m-%d"), row.actual_amount)
+                                if ok:
+                                    st.toast(msg, icon="✅")
+                                    _rerun_fragment()
+                                else:
+                                    st.toast(msg, icon="❌")
+            else:
+                st.info("暫無待確認租金")
+        
+        with col_confirmed:
+            st.subheader("✅ 已確認")
+            
+            if not confirmed.empty:
+                for row in confirmed.itertuples(index=False):
+                    st.write(f"{row.room_number} {row.tenant_name}")
+                    st.caption(f"{row.year}年{row.month}月 - ${row.actual_amount:.0f}")
+            else:
+                st.caption("暫無已確認租金")
+
+
+def _tenant_card(db: RentalDB, row: Dict, lease: str, room_schedule: Optional[pd.DataFrame]):
+    with st.expander(f"🏠 {row['room_number']} - {row['tenant_name']} (${row['base_rent']:.0f} / {row['payment_method']})"):
+        st.write(f"📞 {row['phone']}")
+        st.write(f"📅 租約: {lease}")
+        
+        if row.get('last_ac_cleaning_date'):
+            st.write(f"❄️ 冷氣清潔: {row['last_ac_cleaning_date']}")
+        
+        st.write(f"💳 繳費方式: {row['payment_method']}")
+        
+        if room_schedule is not None:
+            st.markdown("**本年繳費排程：**")
+            for schedule in room_schedule.itertuples(index=False):
+                status_icon = "✅" if schedule.status == "已繳" else "⏳"
+                st.caption(f"{status_icon} {schedule.payment_month}月 - ${schedule.amount:.0f}")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("✏️ 編輯", key=f"edit_{row['id']}", use_container_width=True):
+                st.session_state.edit_id = row['id']
+                st.rerun()
+        
+        with col2:
+            if st.button("🗑️ 刪除", key=f"del_{row['id']}", use_container_width=True):
+                ok, msg = db.delete_tenant(row['id'])
+                if ok:
+                    st.toast(msg, icon="✅")
+                    st.rerun()
+
+
+# 報表數字欄的顯示格式：交給 Styler 整欄套用，資料本身保持數值
+_REPORT_FORMATS = {"私表度數": "{:.2f}", "分攤度數": "{:.2f}", "合計度數": "{:.2f}", "單價": "${:.4f}", "應繳電費": "${:,.0f}"}
+_CALC_FORMATS = {"私表度數": "{:.2f}", "合計度數": "{:.2f}", "電度單價": "${:.4f}/度", "應繳電費": "${:,.0f}"}
+_EXPENSE_FORMATS = {"amount": "${:,.0f}"}
+# 期間摘要卡片: (標題, 以期間欄位 format_map 的樣板, 顏色)
+_PERIOD_CARDS = (
+    ("台電費用", "${tdy_total_fee:,.0f}", "blue"),
+    ("台電度數", "{tdy_total_kwh:.1f}", "green"),
+    ("單價", "${unit_price:.4f}", "orange"),
+    ("公用度數", "{public_kwh}", "blue"),
+)
+
+
+@_fragment
+def _period_history_fragment(db: RentalDB):
+    # 切換期間只重跑此區塊，不必整頁 (含另兩個分頁的表單) 重新執行
+    periods_by_id, period_labels = _cached_periods(db)
+    
+    if not periods_by_id:
+        st.info("暫無歷史期間")
+    else:
+        # 選項直接是期間 id，標籤只在顯示時查表，不必再由標籤反查 id
+        selected_pid = st.selectbox("選擇期間", list(period_labels), format_func=period_labels.__getitem__, key="select_period")
+        
+        period_data = periods_by_id.get(selected_pid)
+        
+        if period_data:
+            display_cards_batch([(title, fmt.format_map(period_data), color) for title, fmt, color in _PERIOD_CARDS])
+            
+            if period_data.get('notes'):
+                st.info(f"📝 {period_data['notes']}")
+            
+            st.divider()
+            
+            report_df = _cached_period_report(db, selected_pid)
+            
+            if not report_df.empty:
+                st.dataframe(report_df.style.format(_REPORT_FORMATS), use_container_width=True, hide_index=True)
+            else:
+                st.warning("無計算資料")
+
+
 def page_dashboard(db: RentalDB):
     st.header("📊 儀表板")
     
-    tenants = db.get_tenants()
     today = date.today()
+    bundle = _cached_dashboard_bundle(db, today.isoformat(), today.year)
+    tenants = bundle['tenants']
     
     st.markdown("### 👥 房間占率")
-    col1, col2, col3, col4 = st.columns(4)
     
     occupancy = len(tenants)
     rate = (occupancy / 12) * 100 if occupancy > 0 else 0
     
-    with col1:
-        display_card("已出租", f"{occupancy}", "green")
-    with col2:
-        display_card("占率", f"{rate:.0f}%", "blue")
-    with col3:
-        display_card("空房", f"{12 - occupancy}", "red")
-    with col4:
-        display_card("總房數", "12", "orange")
+    display_cards_batch([
+        ("已出租", f"{occupancy}", "green"),
+        ("占率", f"{rate:.0f}%", "blue"),
+        ("空房", f"{12 - occupancy}", "red"),
+        ("總房數", "12", "orange"),
+    ])
     
     st.divider()
     
     st.markdown("### 💰 繳費概況")
-    col1, col2, col3 = st.columns(3)
     
-    overdue = db.get_overdue_payments()
-    upcoming = db.get_upcoming_payments(7)
-    summary = db.get_payment_summary(today.year)
+    overdue = bundle['overdue']
+    upcoming = bundle['upcoming']
+    summary = bundle['summary']
     
-    with col1:
-        if len(overdue) > 0:
-            display_card("逾期", f"{len(overdue)}", "red")
-        else:
-            display_card("逾期", "0", "green")
-    with col2:
-        if len(upcoming) > 0:
-            display_card("7天內", f"{len(upcoming)}", "orange")
-        else:
-            display_card("7天內", "0", "green")
-    with col3:
-        display_card("收款率", f"{summary['collection_rate']:.1f}%", "blue")
+    display_cards_batch([
+        ("逾期", f"{len(overdue)}", "red" if len(overdue) > 0 else "green"),
+        ("7天內", f"{len(upcoming)}", "orange" if len(upcoming) > 0 else "green"),
+        ("收款率", f"{summary['collection_rate']:.1f}%", "blue"),
+    ])
     
     st.divider()
     
@@ -903,17 +1486,18 @@ def page_dashboard(db: RentalDB):
     expired = []
     
     if not tenants.empty:
-        for _, t in tenants.iterrows():
-            try:
-                end_date = datetime.strptime(t['lease_end'], "%Y-%m-%d").date()
-                days_left = (end_date - today).days
-                
-                if days_left < 0:
-                    expired.append((t['room_number'], t['tenant_name'], abs(days_left), t['lease_end']))
-                elif 0 <= days_left <= 45:
-                    expiring_soon.append((t['room_number'], t['tenant_name'], days_left, t['lease_end']))
-            except:
-                pass
+        # 一次算出所有租約剩餘天數；日期為 NaT 的變成 NaN，兩個條件都不成立
+        days_left = (tenants['lease_end'] - pd.Timestamp(today)).dt.days
+        lease_end_text = tenants['lease_end'].dt.strftime("%Y-%m-%d")
+        # 到期分類一次向量化算好，提醒區與房間狀態共用；NaN 兩個條件都不成立，歸為 green
+        days = days_left.to_numpy()
+        status_color = np.select([days < 0, days <= 45], ["red", "orange"], default="green")
+        is_expired = status_color == "red"
+        is_soon = status_color == "orange"
+        expired = list(zip(tenants['room_number'][is_expired], tenants['tenant_name'][is_expired],
+                           (-days_left[is_expired]).astype(int), lease_end_text[is_expired]))
+        expiring_soon = list(zip(tenants['room_number'][is_soon], tenants['tenant_name'][is_soon],
+                                 days_left[is_soon].astype(int), lease_end_text[is_soon]))
     
     if expired:
         st.markdown("#### 🔴 租約已過期")
@@ -935,37 +1519,18 @@ def page_dashboard(db: RentalDB):
     st.divider()
     
     st.markdown("### 🏠 房間狀態")
-    active_rooms = tenants.set_index('room_number') if not tenants.empty else pd.DataFrame()
-    
-    if not active_rooms.empty:
-        cols = st.columns(6)
-        for i, room in enumerate(ALL_ROOMS):
-            with cols[i % 6]:
-                if not active_rooms.empty and room in active_rooms.index:
-                    t = active_rooms.loc[room]
-                    try:
-                        days = (datetime.strptime(t['lease_end'], "%Y-%m-%d").date() - today).days
-                        
-                        if days < 0:
-                            status_color = "red"
-                            status_text = f"已過期 {abs(days)} 天"
-                            detail_text = t['lease_end']
-                        elif days <= 45:
-                            status_color = "orange"
-                            status_text = t['tenant_name']
-                            detail_text = f"{days} 天後到期"
-                        else:
-                            status_color = "green"
-                            status_text = t['tenant_name']
-                            detail_text = t.get('payment_method', '月繳')
-                    except:
-                        status_color = "green"
-                        status_text = t['tenant_name']
-                        detail_text = t.get('payment_method', '月繳')
-                    
-                    display_room_card(room, status_color, status_text, detail_text)
-                else:
-                    display_room_card(room, "gray", "空房", "")
+    if not tenants.empty:
+        day_text = days_left.fillna(0).abs().astype(int).astype(str)
+        status_text = np.where(is_expired, "已過期 " + day_text + " 天", tenants['tenant_name'])
+        detail_text = np.select([is_expired, is_soon], [lease_end_text, day_text + " 天後到期"], default=tenants['payment_method'])
+        
+        room_status = pd.DataFrame({'room': tenants['room_number'], 'status_color': status_color,
+                                    'status_text': status_text, 'detail_text': detail_text})
+        # 以全部房號左接房客狀態，沒對到的就是空房
+        rooms_df = (pd.DataFrame({'room': ALL_ROOMS})
+                      .merge(room_status, on='room', how='left')
+                      .fillna({'status_color': "gray", 'status_text': "空房", 'detail_text': ""}))
+        display_room_dataframe(rooms_df)
     else:
         st.info("暫無房客資訊")
     
@@ -974,9 +1539,9 @@ def page_dashboard(db: RentalDB):
     st.markdown("### 📅 租金矩陣")
     year = st.selectbox("選擇年份", [today.year, today.year - 1], key="dash_year")
     
-    rent_matrix = db.get_rent_matrix(year)
+    rent_matrix = _cached_rent_matrix(db, year)
     if not rent_matrix.empty:
-        st.dataframe(rent_matrix, use_container_width=True)
+        st.table(rent_matrix)
     else:
         st.info("暫無租金資訊")
     
@@ -986,20 +1551,11 @@ def page_dashboard(db: RentalDB):
     
     with col_memo:
         st.markdown("### 📝 備忘錄")
-        memos = db.get_memos(completed=False)
-        if not memos.empty:
-            for _, memo in memos.iterrows():
-                c1, c2 = st.columns([5, 1])
-                c1.write(f"📌 {memo['memo_text']}")
-                if c2.button("✓", key=f"m{memo['id']}"):
-                    db.complete_memo(memo['id'])
-                    st.rerun()
-        else:
-            st.caption("無備忘事項")
+        _memo_fragment(db)
     
     with col_unpaid:
         st.markdown("### 🧾 未繳租金")
-        unpaid = db.get_unpaid_rents()
+        unpaid = bundle['unpaid']
         if not unpaid.empty:
             st.dataframe(unpaid, use_container_width=True, hide_index=True)
         else:
@@ -1008,13 +1564,17 @@ def page_dashboard(db: RentalDB):
 
 def page_collect_rent(db: RentalDB):
     st.header("💵 租金收繳")
+    today = date.today()
+    
+    tenants = db.get_tenants()
+    # 房號 -> 房客 namedtuple，選房後直接查 dict 取屬性，不必每次建 pandas Series
+    t_by_room = {t.room_number: t for t in tenants.itertuples(index=False, name="TenantRow")}
     
     tab1, tab2, tab3, tab4 = st.tabs(["單筆預填", "批量預填", "確認繳費", "統計"])
     
     with tab1:
         st.markdown("### 單筆租金預填")
         
-        tenants = db.get_tenants()
         if tenants.empty:
             st.warning("暫無房客")
             return
@@ -1023,21 +1583,21 @@ def page_collect_rent(db: RentalDB):
             col_sel1, col_sel2, col_sel3 = st.columns(3)
             
             with col_sel1:
-                room_options = {f"{r['room_number']} - {r['tenant_name']}": r['room_number'] for _, r in tenants.iterrows()}
+                room_options = dict(zip(tenants['room_number'].astype(str) + " - " + tenants['tenant_name'].astype(str), tenants['room_number']))
                 selected_label = st.selectbox("選擇房間", list(room_options.keys()))
                 room = room_options[selected_label]
-                t_data = tenants[tenants['room_number'] == room].iloc[0]
+                t_data = t_by_room[room]
             
             with col_sel2:
-                year = st.number_input("年份", value=datetime.now().year)
+                year = st.number_input("年份", value=today.year)
             
             with col_sel3:
-                month = st.number_input("月份", value=datetime.now().month, min_value=1, max_value=12)
+                month = st.number_input("月份", value=today.month, min_value=1, max_value=12)
             
             st.divider()
             
-            base_rent = float(t_data['base_rent'])
-            water_fee = WATER_FEE if t_data['has_water_fee'] else 0
+            base_rent = float(t_data.base_rent)
+            water_fee = WATER_FEE if t_data.has_water_fee else 0
             
             col_calc1, col_calc2, col_calc3 = st.columns(3)
             
@@ -1078,15 +1638,14 @@ def page_collect_rent(db: RentalDB):
                 with c1:
                     paid_amt = st.number_input("已繳金額", value=0.0, step=100.0, min_value=0.0)
                 with c2:
-                    paid_date = st.date_input("繳費日期", value=date.today())
+                    paid_date = st.date_input("繳費日期", value=today)
                 
                 notes = st.text_input("備註", placeholder="其他說明")
             
             if st.button("✅ 確認預填", type="primary", use_container_width=True):
-                ok, msg = db.batch_record_rent(room, t_data['tenant_name'], year, month, 1, new_base, new_water, new_discount, t_data['payment_method'], notes)
+                ok, msg = db.batch_record_rent(room, t_data.tenant_name, year, month, 1, new_base, new_water, new_discount, t_data.payment_method, notes)
                 if ok:
                     st.toast(msg, icon="✅")
-                    time.sleep(1)
                     st.rerun()
                 else:
                     st.toast(msg, icon="❌")
@@ -1095,7 +1654,6 @@ def page_collect_rent(db: RentalDB):
         st.markdown("### 批量租金預填")
         st.info("📋 範例：從 2025年1月開始，每月基本租金 $11,471，水費 $115，共預填 12 個月")
         
-        tenants = db.get_tenants()
         if tenants.empty:
             st.warning("暫無房客")
         else:
@@ -1103,16 +1661,16 @@ def page_collect_rent(db: RentalDB):
                 col_sel1, col_sel2, col_sel3 = st.columns(3)
                 
                 with col_sel1:
-                    room_options = {f"{r['room_number']} - {r['tenant_name']}": r['room_number'] for _, r in tenants.iterrows()}
+                    room_options = dict(zip(tenants['room_number'].astype(str) + " - " + tenants['tenant_name'].astype(str), tenants['room_number']))
                     selected_label = st.selectbox("選擇房間", list(room_options.keys()), key="batch_room_sel")
                     room = room_options[selected_label]
-                    t_data = tenants[tenants['room_number'] == room].iloc[0]
+                    t_data = t_by_room[room]
                 
                 with col_sel2:
-                    start_year = st.number_input("起始年份", value=datetime.now().year, key="batch_start_year")
+                    start_year = st.number_input("起始年份", value=today.year, key="batch_start_year")
                 
                 with col_sel3:
-                    start_month = st.number_input("起始月份", value=datetime.now().month, min_value=1, max_value=12, key="batch_start_month")
+                    start_month = st.number_input("起始月份", value=today.month, min_value=1, max_value=12, key="batch_start_month")
                 
                 st.divider()
                 
@@ -1121,7 +1679,7 @@ def page_collect_rent(db: RentalDB):
                 with col_rent:
                     batch_base = st.number_input(
                         "基本租金",
-                        value=float(t_data['base_rent']),
+                        value=float(t_data.base_rent),
                         step=100.0,
                         min_value=0.0,
                         max_value=100000.0,
@@ -1131,7 +1689,7 @@ def page_collect_rent(db: RentalDB):
                 with col_water:
                     batch_water = st.number_input(
                         "水費",
-                        value=float(WATER_FEE if t_data['has_water_fee'] else 0),
+                        value=float(WATER_FEE if t_data.has_water_fee else 0),
                         step=50.0,
                         min_value=0.0,
                         max_value=1000.0,
@@ -1178,91 +1736,68 @@ def page_collect_rent(db: RentalDB):
                     progress_text = "處理中..."
                     my_bar = st.progress(0, text=progress_text)
                     
-                    ok, msg = db.batch_record_rent(room, t_data['tenant_name'], start_year, start_month, months_count, 
-                                                   batch_base, batch_water, batch_discount, t_data['payment_method'], notes)
+                    ok, msg = db.batch_record_rent(room, t_data.tenant_name, start_year, start_month, months_count, 
+                                                   batch_base, batch_water, batch_discount, t_data.payment_method, notes)
                     
                     my_bar.empty()
                     
                     if ok:
                         st.toast(msg, icon="✅")
                         st.balloons()
-                        time.sleep(1)
                         st.rerun()
                     else:
                         st.toast(msg, icon="❌")
     
     with tab3:
         st.markdown("### 確認租金繳費")
-        
-        pending = db.get_pending_rents()
-        if pending.empty:
-            st.success("✅ 無待確認租金")
-        else:
-            col_pending, col_confirmed = st.columns(2)
-            
-            with col_pending:
-                st.subheader("⏳ 待確認")
-                
-                pending_only = pending[pending['status'] != '已收']
-                if not pending_only.empty:
-                    for _, row in pending_only.iterrows():
-                        with st.container(border=True):
-                            col1, col2 = st.columns([3, 1])
-                            
-                            with col1:
-                                st.write(f"{row['room_number']} {row['tenant_name']}")
-                                st.caption(f"{row['year']}年{row['month']}月 - ${row['actual_amount']:.0f}")
-                            
-                            with col2:
-                                if st.button("✅", key=f"confirm{row['id']}", use_container_width=True):
-                                    ok, msg = db.confirm_rent_payment(row['id'], date.today().strftime("%Y-%m-%d"), row['actual_amount'])
-                                    if ok:
-                                        st.toast(msg, icon="✅")
-                                        time.sleep(1)
-                                        st.rerun()
-                                    else:
-                                        st.toast(msg, icon="❌")
-                else:
-                    st.info("暫無待確認租金")
-            
-            with col_confirmed:
-                st.subheader("✅ 已確認")
-                
-                confirmed = pending[pending['status'] == '已收']
-                if not confirmed.empty:
-                    for _, row in confirmed.iterrows():
-                        st.write(f"{row['room_number']} {row['tenant_name']}")
-                        st.caption(f"{row['year']}年{row['month']}月 - ${row['actual_amount']:.0f}")
-                else:
-                    st.caption("暫無已確認租金")
+        _rent_confirm_fragment(db)
     
     with tab4:
         st.subheader("📊 租金統計")
         
-        year_stat = st.number_input("統計年份", value=datetime.now().year, key="rent_year_stat")
+        year_stat = st.number_input("統計年份", value=today.year, key="rent_year_stat")
         
         summary = db.get_rent_summary(year_stat)
         
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("應收租金", f"${summary['total_due']:,.0f}")
-        c2.metric("已收租金", f"${summary['total_paid']:,.0f}")
-        c3.metric("未收租金", f"${summary['total_unpaid']:,.0f}", delta_color="inverse")
-        c4.metric("收款率", f"{summary['collection_rate']:.1f}%")
+        display_cards_batch([
+            ("應收租金", f"${summary['total_due']:,.0f}", "blue"),
+            ("已收租金", f"${summary['total_paid']:,.0f}", "green"),
+            ("未收租金", f"${summary['total_unpaid']:,.0f}", "red" if summary['total_unpaid'] > 0 else "green"),
+            ("收款率", f"{summary['collection_rate']:.1f}%", "orange"),
+        ])
         
         st.divider()
         
         st.subheader("📋 租金明細")
         
-        records = db.get_rent_records(year=year_stat)
+        # 每頁的起點鍵存在 session_state，換年份就回到第一頁；多取一筆用來判斷是否還有下一頁
+        if st.session_state.get("rent_records_year") != year_stat:
+            st.session_state.rent_records_year = year_stat
+            st.session_state.rent_records_after = [None]
+        cursors = st.session_state.rent_records_after
+        records = db.get_rent_records(year=year_stat, after=cursors[-1], limit=RENT_RECORDS_PAGE_SIZE + 1)
+        has_next = len(records) > RENT_RECORDS_PAGE_SIZE
+        records = records.iloc[:RENT_RECORDS_PAGE_SIZE]
         if not records.empty:
-            st.dataframe(records[['year', 'month', 'room_number', 'tenant_name', 'actual_amount', 'paid_amount', 'status', 'paid_date']], 
-                        use_container_width=True, hide_index=True)
+            st.dataframe(records[['year', 'month', 'room_number', 'tenant_name', 'actual_amount', 'paid_amount', 'status', 'paid_date']],
+                         use_container_width=True, hide_index=True)
+            if has_next or len(cursors) > 1:
+                col_prev, col_info, col_next = st.columns([1, 3, 1])
+                if col_prev.button("⬅️ 上一頁", disabled=len(cursors) == 1, key="rent_records_prev"):
+                    cursors.pop()
+                    st.rerun()
+                col_info.caption(f"第 {len(cursors)} 頁")
+                if col_next.button("下一頁 ➡️", disabled=not has_next, key="rent_records_next"):
+                    last = records.iloc[-1]
+                    cursors.append((int(last['year']), int(last['month']), last['room_number']))
+                    st.rerun()
         else:
             st.info("暫無租金記錄")
 
 
 def page_payment_tracker(db: RentalDB):
     st.header("📅 繳費追蹤")
+    today = date.today()
     
     tab1, tab2, tab3, tab4 = st.tabs(["繳費排程", "待繳清單", "繳費統計", "逾期提醒"])
     
@@ -1280,7 +1815,7 @@ def page_payment_tracker(db: RentalDB):
         room = filter_room if filter_room != "全部" else None
         status = filter_status if filter_status != "全部" else None
         
-        schedule_df = db.get_payment_schedule(room=room, status=status, year=datetime.now().year)
+        schedule_df = _cached_schedule(db, room, status, today.year)
         
         if not schedule_df.empty:
             display_cols = ['room_number', 'tenant_name', 'payment_month', 'amount', 'payment_method', 'due_date', 'status', 'paid_date']
@@ -1297,15 +1832,14 @@ def page_payment_tracker(db: RentalDB):
     with tab2:
         st.subheader("待繳清單")
         
-        unpaid = db.get_payment_schedule(status="未繳")
+        unpaid = _cached_schedule(db, None, "未繳", None)
         
         if unpaid.empty:
             st.success("✅ 所有繳費已清")
         else:
-            payment_options = {}
-            for _, row in unpaid.iterrows():
-                label = f"{row['room_number']} {row['tenant_name']} - {row['payment_month']}月 ${row['amount']:.0f}"
-                payment_options[label] = row['id']
+            labels = (unpaid['room_number'].astype(str) + " " + unpaid['tenant_name'].astype(str) + " - "
+                      + unpaid['payment_month'].astype(str) + "月 $" + unpaid['amount'].round().astype('int64').astype(str))
+            payment_options = dict(zip(labels, unpaid['id']))
             
             selected_label = st.selectbox("選擇待繳項目", list(payment_options.keys()), key="select_payment")
             payment_id = payment_options[selected_label]
@@ -1314,7 +1848,7 @@ def page_payment_tracker(db: RentalDB):
                 col1, col2 = st.columns(2)
                 
                 with col1:
-                    paid_date = st.date_input("繳費日期", value=date.today())
+                    paid_date = st.date_input("繳費日期", value=today)
                 
                 with col2:
                     paid_amount = st.number_input("繳費金額", min_value=0.0, step=100.0)
@@ -1325,7 +1859,6 @@ def page_payment_tracker(db: RentalDB):
                     ok, msg = db.mark_payment_done(payment_id, paid_date.strftime("%Y-%m-%d"), paid_amount, notes)
                     if ok:
                         st.toast(msg, icon="✅")
-                        time.sleep(1)
                         st.rerun()
                     else:
                         st.toast(msg, icon="❌")
@@ -1333,15 +1866,16 @@ def page_payment_tracker(db: RentalDB):
     with tab3:
         st.subheader("繳費統計")
         
-        year = st.number_input("統計年份", value=datetime.now().year)
+        year = st.number_input("統計年份", value=today.year)
         
         summary = db.get_payment_summary(year)
         
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("應繳金額", f"${summary['total_due']:,.0f}")
-        col2.metric("已繳金額", f"${summary['total_paid']:,.0f}")
-        col3.metric("未繳筆數", f"{summary['unpaid_count']}")
-        col4.metric("收款率", f"{summary['collection_rate']:.1f}%")
+        display_cards_batch([
+            ("應繳金額", f"${summary['total_due']:,.0f}", "blue"),
+            ("已繳金額", f"${summary['total_paid']:,.0f}", "green"),
+            ("未繳筆數", f"{summary['unpaid_count']}", "red" if summary['unpaid_count'] > 0 else "green"),
+            ("收款率", f"{summary['collection_rate']:.1f}%", "orange"),
+        ])
         
         st.divider()
         
@@ -1373,6 +1907,7 @@ def page_payment_tracker(db: RentalDB):
 
 def page_tenants(db: RentalDB):
     st.header("👥 房客管理")
+    today = date.today()
     
     if "edit_id" not in st.session_state:
         st.session_state.edit_id = None
@@ -1392,7 +1927,7 @@ def page_tenants(db: RentalDB):
             rent = c2.number_input("月租", value=6000.0, min_value=0.0)
             
             s = c1.date_input("租約開始")
-            e = c2.date_input("租約結束", value=date.today() + timedelta(days=365))
+            e = c2.date_input("租約結束", value=today + timedelta(days=365))
             
             st.divider()
             
@@ -1407,11 +1942,10 @@ def page_tenants(db: RentalDB):
             
             if st.form_submit_button("✅ 新增", type="primary"):
                 ok, m = db.upsert_tenant(r, n, p, dep, rent, s.strftime("%Y-%m-%d"), 
-                                        e.strftime("%Y-%m-%d"), pay, False, water, note, ac)
+                                        e.strftime("%Y-%m-%d"), pay, False, water, note, ac_date=ac)
                 if ok:
                     st.toast(m, icon="✅")
                     st.session_state.edit_id = None
-                    time.sleep(1)
                     st.rerun()
                 else:
                     st.toast(m, icon="❌")
@@ -1446,11 +1980,11 @@ def page_tenants(db: RentalDB):
             if st.form_submit_button("✅ 更新", type="primary"):
                 ok, m = db.upsert_tenant(t['room_number'], n, p, t['deposit'], rent, t['lease_start'], 
                                         e.strftime("%Y-%m-%d"), t['payment_method'], 
-                                        t['has_discount'], t['has_water_fee'], t.get('discount_notes', ''), ac, t['id'])
+                                        t['has_discount'], t['has_water_fee'], t.get('discount_notes', ''),
+                                        t.get('annual_discount_months') or 0, ac_date=ac, tenant_id=t['id'])
                 if ok:
                     st.toast(m, icon="✅")
                     st.session_state.edit_id = None
-                    time.sleep(1)
                     st.rerun()
         
         if st.button("🔙 返回"):
@@ -1465,43 +1999,21 @@ def page_tenants(db: RentalDB):
         ts = db.get_tenants()
         
         if not ts.empty:
-            for _, row in ts.iterrows():
-                with st.expander(f"🏠 {row['room_number']} - {row['tenant_name']} (${row['base_rent']:.0f} / {row['payment_method']})"):
-                    st.write(f"📞 {row['phone']}")
-                    st.write(f"📅 租約: {row['lease_start']} ~ {row['lease_end']}")
-                    
-                    if row.get('last_ac_cleaning_date'):
-                        st.write(f"❄️ 冷氣清潔: {row['last_ac_cleaning_date']}")
-                    
-                    st.write(f"💳 繳費方式: {row['payment_method']}")
-                    
-                    room_schedule = db.get_payment_schedule(room=row['room_number'], year=datetime.now().year)
-                    if not room_schedule.empty:
-                        st.markdown("**本年繳費排程：**")
-                        for _, schedule in room_schedule.iterrows():
-                            status_icon = "✅" if schedule['status'] == "已繳" else "⏳"
-                            st.caption(f"{status_icon} {schedule['payment_month']}月 - ${schedule['amount']:.0f}")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        if st.button("✏️ 編輯", key=f"edit_{row['id']}", use_container_width=True):
-                            st.session_state.edit_id = row['id']
-                            st.rerun()
-                    
-                    with col2:
-                        if st.button("🗑️ 刪除", key=f"del_{row['id']}", use_container_width=True):
-                            ok, msg = db.delete_tenant(row['id'])
-                            if ok:
-                                st.toast(msg, icon="✅")
-                                time.sleep(1)
-                                st.rerun()
+            # 全年繳費排程一次撈回再按房號分組，不必每位房客各查一次
+            all_schedule = _cached_schedule(db, None, None, today.year)
+            schedule_by_room = dict(tuple(all_schedule.groupby('room_number', sort=False))) if not all_schedule.empty else {}
+            
+            lease_text = ts['lease_start'].dt.strftime("%Y-%m-%d").fillna("") + " ~ " + ts['lease_end'].dt.strftime("%Y-%m-%d").fillna("")
+            
+            for row, lease in zip(ts.to_dict('records'), lease_text):
+                _tenant_card(db, row, lease, schedule_by_room.get(row['room_number']))
         else:
             st.info("暫無房客")
 
 
 def page_electricity(db: RentalDB):
     st.header("⚡ 電費管理")
+    today = date.today()
     
     if "current_period_id" not in st.session_state:
         st.session_state.current_period_id = None
@@ -1514,7 +2026,7 @@ def page_electricity(db: RentalDB):
             
             col1, col2, col3 = st.columns(3)
             
-            year = col1.number_input("年份", value=datetime.now().year)
+            year = col1.number_input("年份", value=today.year)
             month_start = col2.number_input("開始月份", value=1, min_value=1, max_value=12)
             month_end = col3.number_input("結束月份", value=2, min_value=1, max_value=12)
             
@@ -1523,7 +2035,6 @@ def page_electricity(db: RentalDB):
                 if ok:
                     st.session_state.current_period_id = pid
                     st.toast(msg, icon="✅")
-                    time.sleep(1)
                     st.rerun()
                 else:
                     st.toast(msg, icon="❌")
@@ -1582,18 +2093,12 @@ def page_electricity(db: RentalDB):
                 notes = st.text_area("備註", placeholder="")
                 
                 if st.form_submit_button("✅ 開始計算", type="primary", use_container_width=True):
+                    # 計算器帶每次計算的狀態，每次提交各建一個，不跨使用者共用
                     calc = ElectricityCalculatorV10()
+                    ss = st.session_state
                     
-                    tdy_data = {
-                        "2F": (st.session_state.get("fee2f", 0), st.session_state.get("kwh2f", 0.0)),
-                        "3F": (st.session_state.get("fee3f", 0), st.session_state.get("kwh3f", 0.0)),
-                        "4F": (st.session_state.get("fee4f", 0), st.session_state.get("kwh4f", 0.0))
-                    }
-                    
-                    meter_data = {
-                        room: (st.session_state.get(f"start_{room}", 0.0), st.session_state.get(f"end_{room}", 0.0))
-                        for room in ALL_ROOMS
-                    }
+                    tdy_data = {floor: (ss.get(fee_key, 0), ss.get(kwh_key, 0.0)) for floor, fee_key, kwh_key in TDY_INPUT_KEYS}
+                    meter_data = {room: (ss.get(start_key, 0.0), ss.get(end_key, 0.0)) for room, start_key, end_key in METER_INPUT_KEYS}
                     
                     if not calc.check_tdy_bills(tdy_data):
                         st.error("台電單據檢查失敗")
@@ -1610,11 +2115,19 @@ def page_electricity(db: RentalDB):
                     can_proceed, msg = calc.diagnose()
                     
                     if can_proceed:
-                        ok, msg, df = db.calculate_electricity_fee(st.session_state.current_period_id, calc, meter_data, notes)
+                        pid = st.session_state.current_period_id
+                        # 計算前先保存本期台電單據與各房度數，歷史期間才查得到原始輸入
+                        ok, msg = db.add_tdy_bills_batch(pid, [(floor, kwh, fee) for floor, (fee, kwh) in tdy_data.items() if fee > 0 and kwh > 0])
+                        if ok:
+                            ok, msg = db.add_meter_readings_batch(pid, [(room, s, e) for room, (s, e) in meter_data.items() if e > s])
+                        if not ok:
+                            st.error(msg)
+                            st.stop()
+                        ok, msg, df = db.calculate_electricity_fee(pid, calc, meter_data, notes)
                         if ok:
                             st.balloons()
                             st.toast(msg, icon="✅")
-                            st.dataframe(df, use_container_width=True, hide_index=True)
+                            st.dataframe(df.style.format(_CALC_FORMATS), use_container_width=True, hide_index=True)
                         else:
                             st.toast(msg, icon="❌")
                     else:
@@ -1623,44 +2136,7 @@ def page_electricity(db: RentalDB):
     with tab3:
         st.markdown("### 歷史期間")
         
-        periods = db.get_all_periods()
-        
-        if not periods:
-            st.info("暫無歷史期間")
-        else:
-            period_options = {f"{p['period_year']}年 {p['period_month_start']}-{p['period_month_end']}月": p['id'] for p in periods}
-            
-            selected_period_label = st.selectbox("選擇期間", list(period_options.keys()), key="select_period")
-            selected_pid = period_options[selected_period_label]
-            
-            period_data = next((p for p in periods if p['id'] == selected_pid), None)
-            
-            if period_data:
-                col1, col2, col3, col4 = st.columns(4)
-                
-                with col1:
-                    display_card("台電費用", f"${period_data['tdy_total_fee']:,.0f}", "blue")
-                
-                with col2:
-                    display_card("台電度數", f"{period_data['tdy_total_kwh']:.1f}", "green")
-                
-                with col3:
-                    display_card("單價", f"${period_data['unit_price']:.4f}", "orange")
-                
-                with col4:
-                    display_card("公用度數", f"{period_data['public_kwh']}", "blue")
-                
-                if period_data.get('notes'):
-                    st.info(f"📝 {period_data['notes']}")
-                
-                st.divider()
-                
-                report_df = db.get_period_report(selected_pid)
-                
-                if not report_df.empty:
-                    st.dataframe(report_df, use_container_width=True, hide_index=True)
-                else:
-                    st.warning("無計算資料")
+        _period_history_fragment(db)
 
 
 def page_expenses(db: RentalDB):
@@ -1680,13 +2156,22 @@ def page_expenses(db: RentalDB):
         if st.form_submit_button("✅ 記錄", type="primary", use_container_width=True):
             if db.add_expense(d.strftime("%Y-%m-%d"), cat, amt, desc):
                 st.toast("✅ 已記錄", icon="✅")
-                time.sleep(0.5)
                 st.rerun()
     
     st.divider()
     
     st.subheader("支出記錄")
-    st.dataframe(db.get_expenses(30), use_container_width=True, hide_index=True)
+    st.dataframe(_cached_expenses(db, 30).style.format(_EXPENSE_FORMATS), use_container_width=True, hide_index=True)
+
+
+def _read_xlsx(f) -> pd.DataFrame:
+    # 有裝 python-calamine 就用 Rust 解析器；未安裝 (ImportError) 或 pandas < 2.2 不認得此引擎 (ValueError) 時退回 openpyxl 唯讀模式
+    kwargs = dict(header=1, usecols=lambda c: c in IMPORT_COLUMNS, dtype={"房號": "string", "房客": "string"})
+    try:
+        return pd.read_excel(f, engine="calamine", **kwargs)
+    except (ImportError, ValueError):
+        f.seek(0)
+        return pd.read_excel(f, engine="openpyxl", engine_kwargs={"read_only": True, "data_only": True}, **kwargs)
 
 
 def page_settings(db: RentalDB):
@@ -1699,28 +2184,35 @@ def page_settings(db: RentalDB):
     if f and st.button("🔄 匯入"):
         with st.spinner("處理中..."):
             try:
-                df = pd.read_excel(f, header=1)
+                df = _read_xlsx(f)
+                df = df.rename(columns={"房號": "room", "房客": "name", "租金": "rent"})
+                if "room" not in df:
+                    raise ValueError("找不到「房號」欄位")
                 
-                success = 0
+                df["room"] = df["room"].astype(str).str.strip()
+                df = df[df["room"].isin(ALL_ROOMS_SET)]
+                df["name"] = df["name"].fillna("Unknown").astype(str) if "name" in df else "Unknown"
+                if "rent" not in df:
+                    df["rent"] = 0.0
+                else:
+                    rent = df["rent"]
+                    # 只有含千分位字串的欄才需要整欄去逗號再轉數字，純數字欄直接用
+                    if not pd.api.types.is_numeric_dtype(rent):
+                        rent = pd.to_numeric(rent.astype("string").str.replace(",", "", regex=False), errors="coerce")
+                    # 統一成 float64，itertuples 取出的才是 sqlite3 能綁定的 float
+                    df["rent"] = rent.astype("float64")
+                df = df.dropna(subset=["rent"]).drop_duplicates("room", keep="last")
+                df["start"], df["end"] = "2024-01-01", "2025-12-31"
                 
-                for _, r in df.iterrows():
-                    try:
-                        rm = str(r.get("房號", "")).strip()
-                        
-                        if rm in ALL_ROOMS:
-                            nm = str(r.get("房客", "Unknown"))
-                            rent = float(str(r.get("租金", 0)).replace(",", ""))
-                            end = "2025-12-31"
-                            
-                            ok, _ = db.upsert_tenant(rm, nm, "", 0, rent, "2024-01-01", end)
-                            
-                            if ok:
-                                success += 1
-                    except:
-                        pass
+                ok, msg = db.bulk_upsert_tenants(df[["room", "name", "rent", "start", "end"]].itertuples(index=False, name=None))
                 
-                st.success(f"✅ 成功匯入 {success} 筆")
+                if ok:
+                    st.success(msg)
+                else:
+                    st.error(f"❌ 匯入失敗: {msg}")
             except Exception as e:
+                # 整批清理已向量化，逐列不會再拋例外；只在整體失敗時記一次
+                logger.error(f"房客匯入失敗: {e}")
                 st.error(f"❌ 匯入失敗: {e}")
     
     st.divider()
@@ -1731,6 +2223,7 @@ def page_settings(db: RentalDB):
     
     with col1:
         if st.button("📥 下載備份", use_container_width=True):
+            db.checkpoint()
             with open(db.db_path, "rb") as f:
                 st.download_button(
                     "💾 下載",
@@ -1751,6 +2244,23 @@ def page_settings(db: RentalDB):
 # 主程序
 # ============================================================================
 
+@st.cache_resource
+def get_db(db_path: str = "rental_system_12rooms.db") -> RentalDB:
+    # 全應用共用一個 RentalDB：讀取各自開連線，寫入走帶鎖的專用連線
+    return RentalDB(db_path, on_change=_invalidate_read_caches)
+
+
+@st.cache_resource(max_entries=1)
+def _daily_analyze(_db: RentalDB, day: str) -> bool:
+    # 以日期為鍵，每個程序每天只執行一次
+    try:
+        _db.analyze()
+        return True
+    except sqlite3.Error as e:
+        logger.warning(f"ANALYZE 失敗: {e}")
+        return False
+
+
 def main():
     st.set_page_config(
         page_title="幸福之家 v13.16",
@@ -1758,16 +2268,12 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    _init_logging()
     
-    st.markdown("""
-    <style>
-    .stApp { background-color: #f8f9fa; font-family: '微軟正黑體', 'Microsoft JhengHei', sans-serif; color: #2f3e46; }
-    h1, h2, h3 { color: #52796f; font-weight: 700; }
-    h4, h5, h6 { color: #5c677d; font-weight: 600; }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(_PAGE_STYLE, unsafe_allow_html=True)
     
-    db = RentalDB()
+    db = get_db()
+    _daily_analyze(db, date.today().isoformat())
     
     with st.sidebar:
         st.title("🏠 幸福之家")